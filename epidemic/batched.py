@@ -0,0 +1,156 @@
+import numpy as np
+from epidemic.epidemic_class import epidemic, _torus_stencil_
+from epidemic.sampling import bernoulli_mask, bernoulli_count
+#
+#  Many small epidemic replicates stepped together
+#
+class batched_epidemic():
+    """  This class holds R independent replicates of the epidemic model in one
+    (R, edge, edge) lattice and steps all of them with one set of vectorized
+    operations, so the interpreter overhead of a step is paid once for all the
+    replicates.  This pays off for small lattices (e.g. 100x100) where the
+    per-step Python overhead of epidemic is larger than the numeric work.
+
+    Inputs -
+        replicates - The number of replicates
+        density_threshold - The infected fraction of the whole batch at which a
+            step switches to the stencil kernel (default 0.05, as for epidemic)
+        The remaining inputs are the same as for epidemic
+        NOTE:  The replicates share one np.random.Generator, so every trial is
+        independent, but the path of a replicate depends on the number of
+        replicates and on the other replicates; replicate r is not the same as an
+        epidemic seeded with a child of the seed (use run_ensemble for that)
+
+    The local infection kernels and the neighbor lookup are the ones of epidemic,
+    which step every replicate of the leading (replicates,) axis at once.
+    """
+    #
+    def __init__(self, replicates = None, dim = 2, d = None,
+    target_size = None, I_0 = None,
+    prob_recover = None, prob_local_infect = None,
+    prob_long_dist_infect = None,
+    seed = None, state_dtype = None, bit_generator = None, density_threshold = None
+    ):
+        assert replicates is not None
+        assert replicates >= 1
+        assert d is not None
+        assert I_0 is not None
+        assert dim == 2  #Right now this is only a 2D model
+        assert target_size is not None
+        assert self._check_prob_(prob_recover)
+        assert self._check_prob_(prob_local_infect)
+        assert self._check_prob_(prob_long_dist_infect)
+        self.density_threshold = 0.05 if density_threshold is None else density_threshold
+        assert self._check_prob_(self.density_threshold)
+        self.replicates = int(replicates)
+        self.dim = dim
+        self.d = d
+        self.I_0 = int(I_0)
+        self.prob_recover = prob_recover
+        self.prob_local_infect = prob_local_infect
+        self.prob_long_dist_infect = prob_long_dist_infect
+        self.current_time = 0
+        #  The local infection kernel used by the last step, 'list' or 'density'
+        self.infection_mode = None
+        #  The lattice
+        self.state_dtype = np.dtype(np.uint8 if state_dtype is None else state_dtype)
+        self.S = self.state_dtype.type(0)  #susceptible state
+        self.I = self.state_dtype.type(1)  #infected state
+        self.R = self.state_dtype.type(2)  #recovered state
+        self.edge_size = int(np.float64(target_size)**(1./self.dim) + .5)
+        self.pop_size = self.edge_size ** self.dim  #  The population of one replicate
+        self.lattice_shape = (self.edge_size,) * self.dim
+        self.batch_shape = (self.replicates,)
+        self.people_state = np.empty((self.replicates,) + self.lattice_shape, dtype = self.state_dtype)
+        self.people_state.fill(self.S)
+        #  The neighbor stencil and lookup tables, shared with epidemic
+        (self.coord_array, self.reach, self.torus_tables, self.table_offsets, self.strides,
+            self.flat_offsets) = _torus_stencil_(self.edge_size, self.dim, self.d)
+        self.coord_list = self.coord_array
+        #  The random number generator
+        self.seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.bit_generator = np.random.PCG64 if bit_generator is None else bit_generator
+        self.rng = np.random.Generator(self.bit_generator(self.seed_seq))
+        #  Place I_0 random infected people in every replicate
+        base = np.repeat(np.arange(self.replicates, dtype = np.intp) * self.pop_size, self.I_0)
+        start_flat = base + self.rng.integers(self.pop_size, size = self.replicates * self.I_0)
+        lattice = self.people_state.reshape(-1)
+        lattice[start_flat] = self.I
+        #  The sorted flat indices of the infected people and the per replicate counts
+        self.infected_flat = np.flatnonzero(lattice == self.I)
+        self.num_infected = np.bincount(self.infected_flat // self.pop_size, minlength = self.replicates)
+        self.num_recovered = np.zeros(self.replicates, dtype = np.int64)
+        self.num_susceptible = self.pop_size - self.num_infected
+    ######################################################
+    #  The public accessors
+    ######################################################
+    def get_replicates(self):
+        return self.replicates
+    def get_people_state(self):
+        return self.people_state
+    def get_population_size(self):
+        return self.pop_size
+    def get_edge_size(self):
+        return self.edge_size
+    def get_number_susceptible(self):
+        return self.num_susceptible
+    def get_number_infected(self):
+        return self.num_infected
+    def get_number_recovered(self):
+        return self.num_recovered
+    def get_people_states(self):
+        return self._get_people_states_()
+    #####################################################
+    #  Public action functions
+    #####################################################
+    def single_time_step(self):
+        self._single_time_step_()
+    #  The run loop is the one of epidemic; the counts have a replicates axis
+    #  NOTE:  The run stops early once no replicate has anyone infected
+    run = epidemic.run
+    ######################################################
+    #  The private functions
+    ######################################################
+    _check_prob_ = epidemic._check_prob_
+    def _get_people_states_(self):
+        return self.num_susceptible, self.num_infected, self.num_recovered
+    def _is_extinct_(self):
+        return len(self.infected_flat) == 0
+    def _single_time_step_(self):
+        num_infected = len(self.infected_flat)
+        if num_infected == 0:
+            return
+        lattice = self.people_state.reshape(-1)
+        recovered_mask = bernoulli_mask(self.rng, num_infected, self.prob_recover)
+        recovered_flat = self.infected_flat[recovered_mask]
+        if num_infected >= self.density_threshold * self.replicates * self.pop_size:
+            self.infection_mode = 'density'
+            targets = [self._density_infection_(0, self.edge_size, self.rng)]
+        else:
+            self.infection_mode = 'list'
+            targets = self._local_infection_(self.infected_flat, self.rng)
+        #  Long distance infection stays inside the replicate of the infected person,
+        #  so only the number of tries of each replicate is needed
+        tries = bernoulli_count(self.rng, self.num_infected, self.prob_long_dist_infect)
+        long_targets = np.repeat(np.arange(self.replicates, dtype = np.intp) * self.pop_size, tries)
+        long_targets += self.rng.integers(self.pop_size, size = len(long_targets))
+        targets.append(long_targets[lattice[long_targets] == self.S])
+        new_infected = np.unique(np.concatenate(targets))
+        lattice[new_infected] = self.I
+        lattice[recovered_flat] = self.R
+        #  Per replicate counts from the transitions
+        new_per_replicate = np.bincount(new_infected // self.pop_size, minlength = self.replicates)
+        recovered_per_replicate = np.bincount(recovered_flat // self.pop_size, minlength = self.replicates)
+        self.num_susceptible -= new_per_replicate
+        self.num_infected += new_per_replicate - recovered_per_replicate
+        self.num_recovered += recovered_per_replicate
+        survivors = self.infected_flat[np.logical_not(recovered_mask)]
+        self.infected_flat = np.insert(survivors, np.searchsorted(survivors, new_infected), new_infected)
+        self.current_time += 1
+    #
+    #  The kernels of epidemic; they step every replicate of batch_shape at once
+    #
+    _local_infection_ = epidemic._local_infection_
+    _density_infection_ = epidemic._density_infection_
+    _neighbor_indices_ = epidemic._neighbor_indices_
+    _is_susceptible_ = epidemic._is_susceptible_
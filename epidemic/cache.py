@@ -0,0 +1,207 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from functools import lru_cache
+from collections import namedtuple
+from epidemic.epidemic_class import epidemic, __version__, _json_default_
+#  The result of cached_run
+run_result = namedtuple('run_result', ['times', 'susceptible', 'infected', 'recovered',
+    'people_state', 'cached'])
+#  Constructor arguments that do not change the result of a run
+_UNKEYED_ARGS_ = ('verbose', 'memmap_path')
+#
+#  The version of the code that produced a cached result
+#
+@lru_cache(maxsize = 1)
+def code_version():
+    '''  Returns the package version plus a hash of the epidemic sources
+
+    Output:
+        A string that changes whenever the package version or any module of
+        the epidemic package changes, so stale results are never reused
+        NOTE:  This is computed once per process
+    '''
+    digest = hashlib.sha256()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package_dir)):
+        if name.endswith('.py'):
+            digest.update(name.encode())
+            with open(os.path.join(package_dir, name), 'rb') as f:
+                digest.update(f.read())
+    return '{}+{}'.format(__version__, digest.hexdigest()[:16])
+#
+#  Results on disk keyed by their inputs
+#
+class result_cache():
+    """  This class keeps numpy results on disk, one .npz file per key, where the
+    key is a hash of everything that determines the result (the parameters,
+    the seed and the code version).
+
+    Inputs -
+        path - The cache directory (created if needed)
+        max_bytes - If not None, the least recently used files are removed after
+            a put until the cache holds at most max_bytes (default None)
+            NOTE:  A hit refreshes the modification time of its file, which is
+            the LRU order
+
+    Usage -
+        cache = result_cache('~/.cache/epidemic')
+        key = cache.key(params = params, seed = seed, n_steps = 100)
+        arrays = cache.get(key)
+        if arrays is None:
+            arrays = {'counts': compute(...)}
+            cache.put(key, arrays)
+    """
+    #
+    def __init__(self, path = None, max_bytes = None):
+        assert path is not None
+        assert max_bytes is None or max_bytes > 0
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok = True)
+    ######################################################
+    #  The public functions
+    ######################################################
+    def get_path(self):
+        return self.path
+    def key(self, **inputs):
+        '''  Returns the sha256 hex key of the inputs plus the code version
+
+        Input:
+            inputs - JSON encodable values (numpy scalars and arrays are allowed)
+            NOTE:  The keys are sorted, so the order of the inputs does not matter
+        '''
+        inputs['code_version'] = code_version()
+        text = json.dumps(inputs, sort_keys = True, default = _json_default_)
+        return hashlib.sha256(text.encode()).hexdigest()
+    def contains(self, key = None):
+        return os.path.exists(self._file_(key))
+    def get(self, key = None):
+        '''  Returns the dictionary of arrays stored for key, or None on a miss
+        '''
+        file_name = self._file_(key)
+        try:
+            with np.load(file_name) as data:
+                arrays = dict([(k, data[k]) for k in data.files])
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(file_name)
+        except FileNotFoundError:
+            pass  #  evicted by another process since the load
+        return arrays
+    def put(self, key = None, arrays = None, compressed = False):
+        '''  Stores a dictionary of arrays under key
+            NOTE:  The file is written to a temporary name and renamed, so an
+            interrupted run or a concurrent writer never leaves a partial file
+        '''
+        assert arrays is not None
+        file_name = self._file_(key)
+        os.makedirs(os.path.dirname(file_name), exist_ok = True)
+        fd, tmp_name = tempfile.mkstemp(dir = os.path.dirname(file_name), suffix = '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                (np.savez_compressed if compressed else np.savez)(f, **arrays)
+            os.replace(tmp_name, file_name)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        if self.max_bytes is not None:
+            self._evict_(keep = file_name)
+    def size(self):
+        '''  Returns the number of bytes in the cache files
+        '''
+        return sum([size for _, size, _ in self._entries_()])
+    ######################################################
+    #  The private functions
+    ######################################################
+    def _file_(self, key = None):
+        #  Two character subdirectories keep the directories small
+        return os.path.join(self.path, key[:2], key + '.npz')
+    def _entries_(self):
+        '''  Returns (modification time, size, file name) of every cache file
+        '''
+        entries = []
+        for sub_dir in os.scandir(self.path):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith('.npz'):
+                    try:
+                        info = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((info.st_mtime_ns, info.st_size, entry.path))
+        return entries
+    def _evict_(self, keep = None):
+        '''  Removes the least recently used files until the cache fits in max_bytes
+            NOTE:  The file just written is kept even if it is larger than max_bytes
+        '''
+        entries = sorted(self._entries_())
+        total = sum([size for _, size, _ in entries])
+        for _, size, file_name in entries:
+            if total <= self.max_bytes:
+                break
+            if file_name == keep:
+                continue
+            try:
+                os.unlink(file_name)
+            except FileNotFoundError:
+                pass
+            total -= size
+#
+#  Memoized runs of a seeded model
+#
+def cached_run(n_steps = None, cache_dir = None, max_bytes = None, record_every = None, **model_kwargs):
+    """  Builds epidemic(**model_kwargs) and runs it for n_steps, or returns the
+    stored result of an identical earlier run
+
+    Inputs -
+        n_steps, record_every - The inputs of epidemic.run
+        cache_dir - The result_cache directory
+        max_bytes - The size bound of the cache (default None, unbounded)
+        model_kwargs - The epidemic constructor arguments, including seed
+            NOTE:  A run is only cached when the seed is given; the key covers
+            the constructor arguments (except verbose and memmap_path), the seed,
+            n_steps, record_every and the code version
+
+    Outputs -
+        run_result(times, susceptible, infected, recovered, people_state, cached)
+            NOTE:  people_state is the final lattice; cached is True on a hit
+    """
+    assert n_steps is not None
+    assert cache_dir is not None
+    cache = None
+    if model_kwargs.get('seed') is not None:
+        cache = result_cache(cache_dir, max_bytes = max_bytes)
+        key = cache.key(run = _run_key_(model_kwargs), n_steps = n_steps,
+            record_every = 1 if record_every is None else record_every)
+        arrays = cache.get(key)
+        if arrays is not None:
+            return run_result(arrays['times'], arrays['susceptible'], arrays['infected'],
+                arrays['recovered'], arrays['people_state'], True)
+    model = epidemic(**model_kwargs)
+    times, s, i, r = model.run(n_steps, record_every)
+    model.close()
+    people_state = np.asarray(model.get_people_state())
+    if cache is not None:
+        cache.put(key, {'times': times, 'susceptible': s, 'infected': i, 'recovered': r,
+            'people_state': people_state}, compressed = True)
+    return run_result(times, s, i, r, people_state, False)
+def _run_key_(model_kwargs = None):
+    '''  Converts the constructor arguments to JSON encodable values
+    '''
+    run_key = {}
+    for name, value in model_kwargs.items():
+        if name in _UNKEYED_ARGS_:
+            continue
+        if isinstance(value, np.random.SeedSequence):
+            value = {'entropy': value.entropy, 'spawn_key': list(value.spawn_key)}
+        elif isinstance(value, type):
+            value = value.__name__
+        elif name == 'state_dtype' and value is not None:
+            value = np.dtype(value).str
+        run_key[name] = value
+    return run_key
@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from epidemic.epidemic_class import epidemic
+#
+#  Ensembles of stochastic epidemic replicates
+#
+def run_ensemble(n_replicates = None, n_steps = None, seed = None,
+    max_workers = None, quantiles = None, **model_kwargs):
+    """  Runs independent replicates of the epidemic model on a process pool
+
+    Inputs -
+        n_replicates - The number of replicates to run
+        n_steps - The number of time steps for each replicate
+        seed - The seed of the ensemble (int, np.random.SeedSequence or None)
+            NOTE:  Every replicate gets its own child of a spawned SeedSequence,
+            so the ensemble is reproducible for a given seed and the replicate
+            streams are independent
+        max_workers - The number of worker processes (default: one per core)
+            NOTE:  max_workers = 1 runs the replicates in this process
+        quantiles - The quantiles to report (default (0.05, 0.5, 0.95))
+        model_kwargs - The remaining epidemic constructor arguments (d, target_size, ...)
+            NOTE:  memmap_path is not allowed, the replicates keep their lattices in memory
+
+    Outputs -
+        A dictionary with
+            susceptible, infected, recovered - (n_replicates, n_steps + 1) count arrays
+                NOTE:  A replicate that dies out keeps its final counts
+            mean - (3, n_steps + 1) mean S/I/R counts
+            quantiles, quantile_values - the quantiles and their (len(quantiles), 3, n_steps + 1) values
+            final_size - the number of people ever infected in each replicate
+            final_size_mean, final_size_quantiles - statistics of final_size
+    """
+    assert n_replicates is not None
+    assert n_replicates >= 1
+    assert n_steps is not None
+    assert n_steps >= 0
+    #  Every replicate would open the same memmap file in 'w+' mode
+    assert 'memmap_path' not in model_kwargs
+    quantiles = np.array((0.05, 0.5, 0.95) if quantiles is None else quantiles, dtype = np.float64)
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    tasks = [(child, n_steps, model_kwargs) for child in seed_seq.spawn(n_replicates)]
+    if max_workers == 1:
+        results = [_run_replicate_(t) for t in tasks]
+    else:
+        num_workers = os.cpu_count() if max_workers is None else max_workers
+        #  Batch the tasks so each worker gets a few replicates per round trip
+        chunksize = max(1, n_replicates // (4 * num_workers))
+        with ProcessPoolExecutor(max_workers = num_workers) as executor:
+            results = list(executor.map(_run_replicate_, tasks, chunksize = chunksize))
+    counts = np.stack(results)  # (n_replicates, 3, n_steps + 1)
+    pop_size = counts[0, :, 0].sum()
+    final_size = pop_size - counts[:, 0, -1]
+    return {
+        'susceptible': counts[:, 0, :],
+        'infected': counts[:, 1, :],
+        'recovered': counts[:, 2, :],
+        'mean': counts.mean(axis = 0),
+        'quantiles': quantiles,
+        'quantile_values': np.quantile(counts, quantiles, axis = 0),
+        'final_size': final_size,
+        'final_size_mean': final_size.mean(),
+        'final_size_quantiles': np.quantile(final_size, quantiles),
+    }
+#
+#  The worker for a single replicate
+#
+def _run_replicate_(task = None):
+    '''  Runs one replicate and returns only its compact S/I/R counts
+
+    Input:
+        task - tuple of (seed sequence, number of steps, epidemic constructor arguments)
+
+    Output:
+        (3, n_steps + 1) array of the S/I/R counts at every step
+    '''
+    seed_seq, n_steps, model_kwargs = task
+    model = epidemic(seed = seed_seq, **model_kwargs)
+    times, s, i, r = model.run(n_steps)
+    count_dtype = np.int32 if model.get_population_size() < np.iinfo(np.int32).max else np.int64
+    counts = np.empty((3, n_steps + 1), dtype = count_dtype)
+    steps = times - times[0]
+    for k, series in enumerate((s, i, r)):
+        counts[k, steps] = series
+        #  A replicate that stopped early stays in its final state
+        counts[k, steps[-1]:] = series[-1]
+    return counts
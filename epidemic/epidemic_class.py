@@ -1,8 +1,130 @@
+import os
+import json
+import warnings
 import numpy as np
 import sympy as syp
 from pprint import pprint
+from functools import lru_cache
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from epidemic.numba_kernel import HAVE_NUMBA, _compiled_fused_step_
+from epidemic.torch_kernel import HAVE_TORCH, _torch_stencil_, _torch_generator_, _torch_step_
+from epidemic.profiler import step_profiler, LOOKUP, RECOVER, LOCAL, LONG, MERGE, KERNEL, WRITE
+from epidemic.ring_buffer import ring_buffer
+from epidemic.sampling import iter_bernoulli_indices, bernoulli_mask, \
+    bernoulli_count, skip_batch_size
+from time import perf_counter
 import pkg_resources
 __version__ = pkg_resources.require('ed_scripts')[0].version
+#  The record yielded by epidemic.iter_steps
+#  NOTE:  people_state is the lattice of the model itself, not a copy (None while a
+#  sparse_epidemic is sparse)
+step_record = namedtuple('step_record', ['time', 'susceptible', 'infected', 'recovered',
+    'new_infected', 'new_recovered', 'people_state'])
+#  One record of the execution log, written at the start of every step
+status_dtype = np.dtype([('time', np.int64), ('susceptible', np.int64), ('infected', np.int64),
+    ('recovered', np.int64), ('new_infected', np.int64)])
+#
+#  Generate the stencil of coordinates within d distance
+#
+@lru_cache(maxsize = 32)
+def _coordinate_list_(dim = None, dist = None):
+    '''  This generates the integer coordinates around the origin within a given euclidean distance
+
+    Input:
+        dim - The number of dimensions to use
+        dist - the distance to use
+
+    Output:
+        A read only (K, dim) np.intp array of the valid integer coordinates within
+        the given euclidean distance, in lexicographic order (first axis slowest)
+        NOTE:  These are centered on the origin, so they need to be added to the coordinates use
+        in the computations.
+        NOTE:  The whole (2 int(dist) + 1)^dim cube is tested with one vectorized
+        norm, and the result is cached per (dim, dist)
+    '''
+    assert dim is not None
+    assert isinstance(dim, int)
+    assert dim >= 1
+    assert dist is not None
+    assert isinstance(dist,np.float64)
+    assert dist >= 1.0
+
+    n_dist = int(dist)
+    axis = np.arange(-n_dist, n_dist + 1, dtype = np.intp)
+    cube = np.stack(np.meshgrid(*([axis] * dim), indexing = 'ij'), axis = -1).reshape(-1, dim)
+    #  The same test as np.linalg.norm(c) <= dist, since the squares are exact
+    coords = cube[np.sqrt(np.sum(cube * cube, axis = 1)) <= dist]
+    coords.flags.writeable = False
+    return coords
+#
+#  JSON encoding of numpy values in checkpoints and cache keys (e.g. Philox generator states)
+#
+def _json_default_(value = None):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Cannot encode {} as JSON".format(type(value)))
+#
+#  Torus wrap tables for flat index arithmetic
+#
+@lru_cache(maxsize = 32)
+def _torus_tables_(edge_size = None, dim = None, reach = None):
+    '''  Builds the wrap tables used to find torus neighbors of flat lattice indices
+
+    Input:
+        edge_size - The length of each edge in the lattice
+        dim - The number of dimensions of the lattice
+        reach - The largest absolute coordinate offset that will be looked up
+
+    Output:
+        A tuple with one read only table per axis.  Entry (x + reach) of the table
+        for axis i is the wrapped coordinate x times the axis stride, so the flat
+        index of a neighbor is the sum over the axes of table[coord + offset + reach]
+        NOTE:  The tables are cached, so they are built once per (edge_size, dim, reach)
+    '''
+    assert edge_size is not None
+    assert edge_size > 0
+    assert reach is not None
+    assert reach >= 0
+    wrapped = np.mod(np.arange(-reach, edge_size + reach, dtype = np.intp), edge_size)
+    tables = []
+    for i in range(dim):
+        table = wrapped * edge_size ** (dim - 1 - i)
+        table.flags.writeable = False
+        tables.append(table)
+    return tuple(tables)
+#
+#  The neighbor stencil of a lattice and its lookup tables
+#
+@lru_cache(maxsize = 32)
+def _torus_stencil_(edge_size = None, dim = None, dist = None):
+    '''  Builds the stencil and the tables the kernels use to find torus friends
+
+    Input:
+        edge_size - The length of each edge in the lattice
+        dim - The number of dimensions of the lattice
+        dist - The friend distance (an np.float64)
+
+    Output:
+        coord_array - The (K, dim) stencil offsets of _coordinate_list_
+        reach - The largest absolute coordinate offset of the stencil
+        torus_tables - The wrap tables of _torus_tables_
+        table_offsets - The stencil offsets shifted by reach, so they index the tables
+        strides - The flat stride of every axis of the lattice
+        flat_offsets - The flat index offset of every stencil offset
+        NOTE:  The arrays are read only and cached per (edge_size, dim, dist), so
+        epidemic and batched_epidemic share them
+    '''
+    coord_array = _coordinate_list_(dim, dist)
+    reach = int(np.max(np.abs(coord_array)))
+    table_offsets = coord_array + reach
+    strides = np.array([edge_size ** (dim - 1 - i) for i in range(dim)], dtype = np.intp)
+    flat_offsets = coord_array @ strides
+    for array in (table_offsets, strides, flat_offsets):
+        array.flags.writeable = False
+    return coord_array, reach, _torus_tables_(edge_size, dim, reach), table_offsets, strides, flat_offsets
 #
 #  The epidemic class
 #
@@ -24,14 +146,50 @@ class epidemic():
         a susceptible friend
         prob_long_dist_infect - The probability that an infected person will 
         infect someone not in the friend circle (kinda)
-        seed - If not none, then it sets the numpy random number seed
+        seed - Seeds the random number generator of this model; an int or a
+            np.random.SeedSequence (e.g. one spawned for a replicate)
+            NOTE:  Each model has its own np.random.Generator, so models do not
+            share or disturb the global numpy random state
+        bit_generator - The numpy bit generator class to use (default np.random.PCG64)
+        density_threshold - The infected fraction at which a step switches from
+            the infected list kernel to the whole lattice stencil kernel (default 0.05)
+            NOTE:  Both kernels infect a susceptible person with k infected friends
+            with probability 1-(1-prob_local_infect)^k
+        n_threads - When larger than 1, every step splits the lattice into n_threads
+            strips of rows that are stepped on a thread pool (default 1)
+            NOTE:  Each strip has its own np.random.Generator seeded by child i of the
+            seed (spawn_key + (i,)), so the results depend on n_threads but not on
+            the thread scheduling; the given SeedSequence is not changed
+        backend - 'numpy' (default), 'numba' or 'torch'
+            NOTE:  'numba' runs the whole step as one compiled loop over the infected
+            people with no temporary arrays; it takes the same path as the numpy list
+            kernel for the same seed, ignores density_threshold and n_threads, and
+            falls back to 'numpy' (with a warning) when Numba is not installed
+            NOTE:  'torch' counts the infected friends with a circular conv2d on the
+            CPU and draws with a torch.Generator seeded from seed, using the torch
+            intra-op threads instead of n_threads; it also falls back to 'numpy'
+        memmap_path - If not None, the lattice is an np.memmap on this file, so it
+            can be larger than RAM (the file is created or overwritten)
+        state_dtype - The numpy dtype used to store the lattice states
+            NOTE:  Defaults to np.uint8 (one byte per person); np.int64 recovers
+            the original (eight bytes per person) storage
+        status_capacity - The number of steps kept in the execution log (default 1024)
+            NOTE:  The log is a ring buffer of numeric records, so its memory does
+            not grow with the length of a run; get_exec_status formats the text
+        block_size - If not None, the model keeps the S/I/R counts of every
+            block_size x block_size block of the lattice (default None)
+            NOTE:  The block counts are updated from the people that changed in
+            each step, so the regional view costs O(events) rather than a scan of
+            the lattice; the last row and column of blocks can be partial
     """
     #
     def __init__(self, dim = 2, d = None,
     target_size = None, I_0 = None,
     prob_recover = None, prob_local_infect = None,
     prob_long_dist_infect = None, 
-    seed = None, verbose = None
+    seed = None, verbose = None, state_dtype = None,
+    bit_generator = None, density_threshold = None, n_threads = None,
+    backend = None, memmap_path = None, block_size = None, status_capacity = None
     ):
         """
         
@@ -45,13 +203,21 @@ class epidemic():
         assert self._check_prob_(prob_recover)
         assert self._check_prob_(prob_local_infect)
         assert self._check_prob_(prob_long_dist_infect)
+        self.density_threshold = 0.05 if density_threshold is None else density_threshold
+        assert self._check_prob_(self.density_threshold)
+        #  The local infection kernel used by the last step, 'list' or 'density'
+        self.infection_mode = None
+        self.state_dtype = np.dtype(np.uint8 if state_dtype is None else state_dtype)
+        assert np.issubdtype(self.state_dtype, np.integer)
         #
         #  Define the initialization state
+        #  NOTE:  The states have the lattice dtype so comparisons and writes
+        #  never upcast the lattice
         #
-        self.S = np.int(0)  #susceptible state
-        self.I = np.int(1)  #infected state
-        self.R = np.int(2)  #recovered state
-        self.I_0 = np.int(I_0)
+        self.S = self.state_dtype.type(0)  #susceptible state
+        self.I = self.state_dtype.type(1)  #infected state
+        self.R = self.state_dtype.type(2)  #recovered state
+        self.I_0 = int(I_0)
         self.current_time = 0
         self.VERBOSE = verbose if not(verbose is None) else False
         self.dim = 2  #The number of dimensions to use
@@ -61,6 +227,17 @@ class epidemic():
         self.pop_size = None
         self.edge_size = None
         self.people_state = None
+        self.lattice_shape = None
+        self.memmap_path = memmap_path
+        #  Running S/I/R counts, updated from the transitions of each step
+        self.num_susceptible = None
+        self.num_infected = None
+        self.num_recovered = None
+        #  The sorted flat (raveled) lattice indices of the infected people
+        self.infected_flat = None
+        #  The flat indices that changed in the last step (S->I and I->R)
+        self.last_new_infected = np.empty(0, dtype = np.intp)
+        self.last_new_recovered = np.empty(0, dtype = np.intp)
         
         #  These are the state transition probabilities
         self.prob_recover = prob_recover
@@ -69,25 +246,80 @@ class epidemic():
         #
         self.d = d
         #  The status queue
-        self.exec_status = []  #  This should be a list of strings for the operating status
-        #build the coordinate list
-        self.coord_list = self._generate_coordinate_list_(self.dim, self.d)
+        self.exec_status = ring_buffer(status_dtype, 1024 if status_capacity is None else status_capacity)
+        #  The step_profiler, None unless profiling is enabled
+        self.profiler = None
         #build the initial state
         self.pop_size, self.edge_size, self.people_state = self._create_population_(self.dim, target_size)
-        #set the initial random number
-        if (not (seed is None)) and isinstance(seed, int):
-            np.random.seed(seed)
+        self.lattice_shape = tuple([self.edge_size for i in range(self.dim)])
+        #  The leading (replicate) axes in front of the lattice; batched_epidemic has one
+        self.batch_shape = ()
+        #build the coordinate list and the neighbor lookup tables
+        (self.coord_array, self.reach, self.torus_tables, self.table_offsets, self.strides,
+            self.flat_offsets) = _torus_stencil_(self.edge_size, self.dim, self.d)
+        self.coord_list = self.coord_array
+        #build the random number generator of this model
+        self.seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.bit_generator = np.random.PCG64 if bit_generator is None else bit_generator
+        self.rng = np.random.Generator(self.bit_generator(self.seed_seq))
+        #set up the strips (tiles) of rows for threaded steps
+        self.n_threads = 1 if n_threads is None else int(n_threads)
+        assert self.n_threads >= 1
+        assert self.n_threads <= self.edge_size
+        self.tile_rows = np.linspace(0, self.edge_size, self.n_threads + 1).astype(np.intp)
+        self.tile_rngs = None
+        self.executor = None
+        if self.n_threads > 1:
+            #  The children are built, not spawned, so the caller's SeedSequence is not changed
+            self.tile_rngs = [np.random.Generator(self.bit_generator(np.random.SeedSequence(
+                self.seed_seq.entropy, spawn_key = self.seed_seq.spawn_key + (i,),
+                pool_size = self.seed_seq.pool_size))) for i in range(self.n_threads)]
+            self.executor = ThreadPoolExecutor(max_workers = self.n_threads)
+        #set up the step backend
+        self.backend = 'numpy' if backend is None else backend
+        assert self.backend in ('numpy', 'numba', 'torch')
+        if self.backend == 'numba' and not HAVE_NUMBA:
+            warnings.warn("Numba is not installed, the epidemic model uses the numpy backend")
+            self.backend = 'numpy'
+        if self.backend == 'torch' and not HAVE_TORCH:
+            warnings.warn("PyTorch is not installed, the epidemic model uses the numpy backend")
+            self.backend = 'numpy'
+        self.torch_stencil = None
+        self.torch_generator = None
+        if self.backend == 'torch':
+            assert self.dim == 2  #conv2d
+            self.torch_stencil = _torch_stencil_(self.coord_array, self.reach)
+            self.torch_generator = _torch_generator_(self.seed_seq)
+        self.stacked_tables = np.stack(self.torus_tables) if self.backend == 'numba' else None
+        self.work_buffer = None
         #set the number infected
-        start_infection_indices = np.random.randint(self.edge_size, size = (self.I_0, self.dim))
+        start_infection_indices = self.rng.integers(self.edge_size, size = (self.I_0, self.dim))
         location_tuple = tuple([start_infection_indices[:,i] for i in range(self.dim)])
-        self.people_state[location_tuple] = self.I
+        #  The start locations can repeat
+        self.infected_flat = np.unique(np.ravel_multi_index(location_tuple, self.lattice_shape))
+        self.num_infected = len(self.infected_flat)
+        self.num_recovered = 0
+        self.num_susceptible = self.pop_size - self.num_infected
+        self._write_states_(self.infected_flat, self.I)
+        #set up the coarse S/I/R counts of the blocks
+        self.block_size = None if block_size is None else int(block_size)
+        self.block_shape = None
+        self.block_cells = None
+        self.block_counts = None
+        if self.block_size is not None:
+            assert 0 < self.block_size <= self.edge_size
+            self._build_block_counts_()
     ######################################################
     #  The public functions that are accessors for the public
     ######################################################
     def get_coordinate_list(self):
+        '''  Returns the (K, dim) array of stencil offsets (see _coordinate_list_)
+        '''
         return self.coord_list
     def get_people_state(self):
         return self.people_state
+    def get_state_dtype(self):
+        return self.state_dtype
     def get_population_size(self):
         return self.pop_size
     def get_edge_size(self):
@@ -106,10 +338,49 @@ class epidemic():
         return self._get_number_susceptible_()
     def get_people_states(self):
         return self._get_people_states_()
+    def get_infected_indices(self):
+        return self.infected_flat
+    def get_last_transitions(self):
+        return self.last_new_infected, self.last_new_recovered
     def get_verbose(self):
         return self.VERBOSE
+    def get_rng(self):
+        return self.rng
     def get_exec_status(self):
-        return self.exec_status
+        '''  Returns the execution log of the kept steps as a list of strings
+            NOTE:  The text is only built here, from the numeric records
+        '''
+        status = []
+        for record in self.exec_status.records():
+            status.append("Current Time: {}\n".format(record['time']))
+            if record['infected'] == 0:
+                status.append("\tNumber Infected is 0.\n")
+        return status
+    def get_exec_log(self):
+        '''  Returns the execution log records (see status_dtype), oldest first
+        '''
+        return self.exec_status.records()
+    def get_profile(self):
+        '''  Returns the per step profile records (see epidemic.profiler.profile_dtype)
+        '''
+        assert self.profiler is not None
+        return self.profiler.get_records()
+    def get_profile_summary(self):
+        assert self.profiler is not None
+        return self.profiler.summary()
+    def get_block_size(self):
+        return self.block_size
+    def get_block_counts(self):
+        '''  Returns the (3,) + block_shape S/I/R counts of the blocks
+            NOTE:  This is the array the model updates, not a copy
+        '''
+        assert self.block_counts is not None
+        return self.block_counts
+    def get_prevalence_map(self):
+        '''  Returns the infected fraction of every block as a float64 array
+        '''
+        assert self.block_counts is not None
+        return self.block_counts[1] / self.block_cells
     #####################################################
     #  Public setter functions
     #####################################################
@@ -128,20 +399,208 @@ class epidemic():
     #
     def single_time_step(self):
         self._single_time_step_()
+    def close(self):
+        '''  Shuts down the thread pool of a threaded model
+        '''
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.disable_profiling()
+    #
+    #  Per phase timing of the steps
+    #
+    def enable_profiling(self, capacity = None, trace_memory = None):
+        '''  Starts recording the time of every phase of the steps
+
+        Input:
+            capacity - The number of steps kept in the ring buffer (default 4096)
+            trace_memory - If True, also record the bytes allocated in every step
+                with tracemalloc (default False)
+            NOTE:  Without a profiler a step only checks that self.profiler is None
+        '''
+        self.disable_profiling()
+        self.profiler = step_profiler(capacity, trace_memory)
+    def disable_profiling(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+    #
+    #  Lazily stream the steps of a run
+    #
+    def iter_steps(self, n_steps = None):
+        """  A generator that steps the model and yields a step_record after every step
+
+        Inputs:
+            n_steps - The maximum number of steps (default: until no one is infected)
+
+        Outputs:
+            step_record(time, susceptible, infected, recovered, new_infected,
+            new_recovered, people_state) for every step
+            NOTE:  new_infected and new_recovered are the flat indices that changed
+            in the step and people_state is the model lattice by reference, so a
+            consumer that keeps a lattice must copy it
+            NOTE:  A sparse_epidemic has no lattice until it switches to the dense
+            one, so people_state is None while it is sparse; the changed indices
+            are always given (get_people_state builds a lattice on request)
+        """
+        step = 0
+        while (n_steps is None or step < n_steps) and self.num_infected > 0:
+            self._single_time_step_()
+            step += 1
+            yield step_record(self.current_time, self.num_susceptible, self.num_infected,
+                self.num_recovered, self.last_new_infected, self.last_new_recovered, self.people_state)
+    #
+    #  Checkpoint and restore
+    #
+    def checkpoint(self, path = None):
+        """  Saves the state of the model so a run can be resumed bit for bit
+
+        Inputs:
+            path - The checkpoint directory (created if needed)
+                NOTE:  The lattice is written by numpy straight from its buffer to
+                people_state.npy; the counts, time, infected index and the
+                random number generator states go to state.npz
+                NOTE:  The records kept in the execution log are saved too
+        """
+        assert path is not None
+        os.makedirs(path, exist_ok = True)
+        if self.people_state is not None:
+            if isinstance(self.people_state, np.memmap):
+                self.people_state.flush()
+            np.save(os.path.join(path, 'people_state.npy'), self.people_state)
+        meta = {
+            'version': __version__,
+            'lattice_shape': list(self.lattice_shape),
+            'state_dtype': self.state_dtype.str,
+            'current_time': self.current_time,
+            'counts': [int(n) for n in self._get_people_states_()],
+            'rng': self.rng.bit_generator.state,
+            'tile_rngs': [] if self.tile_rngs is None else [g.bit_generator.state for g in self.tile_rngs],
+        }
+        arrays = self._checkpoint_arrays_()
+        arrays['exec_status'], meta['exec_status_count'] = self.exec_status.get_state()
+        if self.torch_generator is not None:
+            arrays['torch_generator'] = self.torch_generator.get_state().numpy()
+        np.savez(os.path.join(path, 'state.npz'), meta = np.array(json.dumps(meta, default = _json_default_)), **arrays)
+    def restore(self, path = None):
+        """  Restores a checkpoint made by a model built with the same inputs
+
+        Inputs:
+            path - The checkpoint directory
+                NOTE:  The saved lattice is memory mapped and copied into the
+                lattice of this model (which can itself be an np.memmap)
+        """
+        assert path is not None
+        with np.load(os.path.join(path, 'state.npz')) as data:
+            meta = json.loads(str(data['meta']))
+            arrays = dict([(k, data[k]) for k in data.files if k != 'meta'])
+        assert tuple(meta['lattice_shape']) == self.lattice_shape
+        assert np.dtype(meta['state_dtype']) == self.state_dtype
+        assert len(meta['tile_rngs']) == (0 if self.tile_rngs is None else len(self.tile_rngs))
+        lattice_file = os.path.join(path, 'people_state.npy')
+        self._restore_lattice_(lattice_file if os.path.exists(lattice_file) else None)
+        self._restore_arrays_(arrays)
+        self.num_susceptible, self.num_infected, self.num_recovered = meta['counts']
+        self.current_time = meta['current_time']
+        if 'exec_status' in arrays:
+            self.exec_status.set_state(arrays['exec_status'], meta['exec_status_count'])
+        self.rng.bit_generator.state = meta['rng']
+        for g, state in zip(self.tile_rngs or [], meta['tile_rngs']):
+            g.bit_generator.state = state
+        if self.torch_generator is not None:
+            import torch
+            self.torch_generator.set_state(torch.from_numpy(arrays['torch_generator']))
+    #
+    #  Run several time steps and return the S/I/R time series
+    #
+    def run(self, n_steps = None, record_every = None):
+        """  Runs up to n_steps time steps, recording the S/I/R counts
+
+        Inputs:
+            n_steps - The maximum number of time steps to run
+            record_every - Record the counts every record_every steps (default 1)
+                NOTE:  The starting state is always recorded and so is the last
+                state, including an early stop when no one is infected; a model
+                with no one infected is not stepped, so only the start is recorded
+
+        Outputs:
+            times - The time of each record
+            susceptible - The number susceptible at each record
+            infected - The number infected at each record
+            recovered - The number recovered at each record
+            NOTE:  batched_epidemic shares this loop; its counts have a leading
+            replicates axis, so each series is a (replicates, records) array
+        """
+        assert n_steps is not None
+        assert n_steps >= 0
+        record_every = 1 if record_every is None else int(record_every)
+        assert record_every >= 1
+        #  Preallocate room for every record plus a final partial interval
+        num_records = n_steps // record_every + 2
+        times = np.empty(num_records, dtype = np.int64)
+        counts = np.empty((3,) + np.shape(self.num_infected) + (num_records,), dtype = np.int64)
+        times[0] = self.current_time
+        counts[..., 0] = self._get_people_states_()
+        n_rec = 1
+        if self._is_extinct_():
+            n_steps = 0
+        for step in range(1, n_steps + 1):
+            self._single_time_step_()
+            done = self._is_extinct_()
+            if step % record_every == 0 or step == n_steps or done:
+                times[n_rec] = self.current_time
+                counts[..., n_rec] = self._get_people_states_()
+                n_rec += 1
+            if done:
+                break
+        return times[:n_rec], counts[0, ..., :n_rec], counts[1, ..., :n_rec], counts[2, ..., :n_rec]
     ######################################################
     #  The private functions that will only be called internally
     ######################################################  
     #
     #  Simple internal functions that have public interfaces
     #
+    #  NOTE:  These read the running counts, so they are O(1)
+    #
     def _get_number_recovered_(self):
-        return len(np.where(self.people_state == self.R)[0])
+        return self.num_recovered
     def _get_number_infected_(self):
-        return len(np.where(self.people_state == self.I)[0])
+        return self.num_infected
     def _get_number_susceptible_(self):
-        return len(np.where(self.people_state == self.S)[0])
+        return self.num_susceptible
     def _get_people_states_(self):
-        return self._get_number_susceptible_(), self._get_number_infected_(), self._get_number_recovered_()
+        return self.num_susceptible, self.num_infected, self.num_recovered
+    def _is_extinct_(self):
+        return self.num_infected == 0
+    #
+    #  Full lattice scan of the states; only used to (re)build the running counts
+    #
+    def _count_people_states_(self):
+        return (int(np.count_nonzero(self.people_state == self.S)),
+            int(np.count_nonzero(self.people_state == self.I)),
+            int(np.count_nonzero(self.people_state == self.R)))
+    #
+    #  Apply the transition counts of a step to the running counts
+    #
+    def _update_counts_(self, num_new_infected = 0, num_new_recovered = 0):
+        self.num_susceptible -= num_new_infected
+        self.num_infected += num_new_infected - num_new_recovered
+        self.num_recovered += num_new_recovered
+    #
+    #  Update the infected index from the transitions of a step
+    #
+    def _update_infected_index_(self, new_infected = None, recovered_mask = None):
+        '''  Removes the recovered people and merges in the newly infected ones
+
+        Input:
+            new_infected - sorted unique flat indices of the newly infected people
+            recovered_mask - boolean mask over self.infected_flat of the recovered people
+
+        Output:
+            None, self.infected_flat is replaced and stays sorted
+        '''
+        survivors = self.infected_flat[np.logical_not(recovered_mask)]
+        self.infected_flat = np.insert(survivors, np.searchsorted(survivors, new_infected), new_infected)
     #
     #  simple range checker for probabilities
     #
@@ -156,163 +615,383 @@ class epidemic():
             return False
         return True
     def _single_time_step_(self):
-        self.exec_status.append("Current Time: {}\n".format(self.current_time))
+        self.exec_status.append((self.current_time, self.num_susceptible, self.num_infected,
+            self.num_recovered, len(self.last_new_infected)))
         # print(i_state)
         if self.VERBOSE:
             print("Current Time: {}".format(self.current_time))
         num_infected = self._get_number_infected_()
         if num_infected == 0:
             #This model doesn't spontaneously create infected people
-            self.exec_status.append("\tNumber Infected is 0.\n")
+            self.last_new_infected = np.empty(0, dtype = np.intp)
+            self.last_new_recovered = np.empty(0, dtype = np.intp)
             return
-        infected_persons = np.where(self.people_state == self.I)
-        rand_to_recover = np.random.uniform(size=num_infected) #rand_to_recover is a 1 dim tuple
-        recovered = np.where(rand_to_recover < self.prob_recover)  
-        recovered_indices = tuple([infected_persons[i][recovered] for i in range(self.dim)])
-        #  Build arrays for all of the infection updates.
-        # all_changes_x = np.empty((0),dtype=np.int)
-        # all_changes_y = np.empty((0),dtype=np.int)
-        for c in self.coord_list:
-            c_indices = [self._wrap_(self.edge_size,infected_persons[i] + c[i]) for i in range(self.dim)]
-            infected_indices = self._choose_random_indices_(c_indices, self.prob_local_infect)
-            if len(infected_indices) > 0:
-                s_state_indices = np.where(self.people_state[infected_indices] == self.S)
-                valid_indices = tuple([infected_indices[i][s_state_indices] for i in range(self.dim)])
-                self.people_state[valid_indices] = self.I
-                #add the new indices to the previously found ones
-                # all_changes_x = np.concatenate((all_changes_x, infected_indices[0][s_state_indices]))
-                # all_changes_y = np.concatenate((all_changes_y, infected_indices[1][s_state_indices]))
-        #Try long distance infections
-        rand_long_indices = np.random.randint(self.edge_size,size=(num_infected,self.dim))
-        rand_choose = np.where(np.random.uniform(size = num_infected) < self.prob_long_dist_infect)
-        rand_long_indices = rand_long_indices[rand_choose]
-        if len(rand_choose) > 0:
-            parallel_indices = tuple([rand_long_indices[:,i] for i in range(self.dim)])
-            s_state_indices = np.where(self.people_state[parallel_indices] ==  self.S)
-            s_state_indices = s_state_indices[0]
-            if len(s_state_indices) > 0:
-                valid_indices = tuple([rand_long_indices[:,i][s_state_indices] for i in range(self.dim)])
-                self.people_state[valid_indices] = self.I
-                #Add these indices to the previously found ones
-                # all_changes_x = np.concatenate((all_changes_x, rand_long_indices[:,0][s_state_indices]))
-                # all_changes_y = np.concatenate((all_changes_y, rand_long_indices[:,1][s_state_indices]))
-        # self.people_state[(all_changes_x, all_changes_y)] = self.I
-        self.people_state[recovered_indices] =  self.R
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_step(self.current_time, num_infected)
+        written = False
+        if self.backend == 'numba' and self.people_state is not None:
+            self.infection_mode = 'fused'
+            new_infected, recovered_mask = self._compiled_step_()
+            written = True
+        elif self.backend == 'torch' and self.people_state is not None:
+            self.infection_mode = 'torch'
+            new_infected, recovered_mask = _torch_step_(self.people_state, self.infected_flat,
+                self.torch_stencil, self.reach, self.prob_recover, self.prob_local_infect,
+                self.prob_long_dist_infect, self.S, self.I, self.torch_generator)
+        else:
+            new_infected, recovered_mask = self._numpy_step_()
+        if profiler is None:
+            self._apply_transitions_(new_infected, recovered_mask, written = written)
+        else:
+            if self.infection_mode in ('fused', 'torch'):
+                profiler.lap(KERNEL, profiler.step_start)
+            tick = perf_counter()
+            self._apply_transitions_(new_infected, recovered_mask, written = written)
+            profiler.lap(WRITE, tick)
+            profiler.end_step(len(self.last_new_infected), len(self.last_new_recovered))
         self.current_time += 1
         return
     #
-    #  Create Population  -  We always create a population with the approximate size
+    #  The numpy step
     #
-    def _create_population_(self, n_dim = None, total_pop = None):
-        """  Creates the city population and initialize to the s_state
+    def _numpy_step_(self):
+        '''  Draws the transitions of a step with the numpy kernels, by strips when threaded
 
-        Inputs:
-            n_dim - number of dimensions of the lattice
-            total_pop - Approximate number of people
+        Output:
+            new_infected - sorted unique flat indices of the newly infected people
+            recovered_mask - boolean mask over self.infected_flat of the recovered people
+        '''
+        use_density = self._use_density_kernel_()
+        self.infection_mode = 'density' if use_density else 'list'
+        if self.n_threads > 1:
+            #  The strips only read the lattice; their results are merged below
+            results = list(self.executor.map(self._step_tile_, range(self.n_threads),
+                [use_density] * self.n_threads))
+        else:
+            results = [self._step_tile_(None, use_density)]
+        tick = None if self.profiler is None else perf_counter()
+        #  The strips hold consecutive slices of the sorted infected index
+        recovered_mask = np.concatenate([r[0] for r in results])
+        #  A person reached more than once is only infected once
+        new_infected = np.unique(np.concatenate([t for r in results for t in r[1]]))
+        if tick is not None:
+            self.profiler.lap(MERGE, tick)
+        return new_infected, recovered_mask
+    #
+    #  The compiled (Numba) step
+    #
+    def _compiled_step_(self):
+        '''  Runs the compiled step, which writes the lattice as it goes
 
-        Outputs:
-            computed_pop - computed number of people to use
-            edge_size - The length of each edge in the lattice
-            pop_lattice - the state lattice
-        """
-        lattice_dim = np.int(n_dim)
-        edge_size = np.int(np.float64(total_pop)**(1./lattice_dim) + .5)
-        computed_pop = edge_size ** lattice_dim
-        lattice_struct = tuple([edge_size for i in range(lattice_dim)])
-        pop_lattice = np.zeros(lattice_struct).astype(int)  
-        pop_lattice.fill(self.S)
-        return computed_pop, edge_size, pop_lattice  
+        Output:
+            new_infected - sorted flat indices of the newly infected people
+            recovered_mask - boolean mask over self.infected_flat of the recovered people
+        '''
+        num_infected = len(self.infected_flat)
+        #  Reuse one output buffer across steps, it only grows
+        needed = min(num_infected * (len(self.coord_array) + 1), self.pop_size)
+        if self.work_buffer is None or len(self.work_buffer) < needed:
+            self.work_buffer = np.empty(max(needed, 2 * (0 if self.work_buffer is None else len(self.work_buffer))),
+                dtype = np.intp)
+        recovered_mask = np.empty(num_infected, dtype = bool)
+        num_new = _compiled_fused_step_()(self.people_state.reshape(-1), self.infected_flat, self.stacked_tables,
+            self.table_offsets, self.strides, self.edge_size, self.pop_size,
+            self.prob_recover, self.prob_local_infect, self.prob_long_dist_infect,
+            self.S, self.I, self.R, self.rng, recovered_mask, self.work_buffer,
+            skip_batch_size(num_infected, self.prob_recover),
+            skip_batch_size(num_infected * len(self.table_offsets), self.prob_local_infect))
+        return np.sort(self.work_buffer[:num_new]), recovered_mask
     #
-    #  Generate the list of coordinates within d distance - We always create a coordinate list
+    #  Step one strip of rows
     #
-    def _generate_coordinate_list_(self, dim = None, dist = None):
-        '''  This generates the list of integer coordinates around 0,0 within a given euclidean distance
-            NOTE:  This uses a recursive algorithm
+    def _step_tile_(self, tile = None, use_density = None):
+        '''  Draws the transitions caused by the infected people of one strip of rows
 
         Input:
-            dim - The number of dimensions to use
-            dist - the distance to use
+            tile - The strip number, or None for the whole lattice
+            use_density - True to use the stencil kernel for the local infections
 
         Output:
-            A python list of the valid interger coordinates within the given euclidean distance
-            NOTE:  These are centered on the origin, so they need to be added to the coordinates use
-            in the computations.
+            recovered_mask - boolean mask over the infected people of the strip
+            targets - list of arrays of flat indices of susceptible people who are infected
+            NOTE:  Nothing is written; local infections can fall in the halo of
+            reach rows around the strip, which is why the merge happens afterwards
         '''
-        assert dim is not None
-        assert isinstance(dim, int)
-        assert dim >= 1
-        assert dim <= 3
-        assert dist is not None
-        assert isinstance(dist,np.float64)
-        assert dist >= 1.0
-        assert dist <= 5.0
-
-        if dim == 1:
-            n_dist = int(dist)
-            list_index = [[i] for i in range(-n_dist, n_dist + 1,1)]
-            return list_index
+        profiler = self.profiler
+        if profiler is not None:
+            tick = perf_counter()
+        if tile is None:
+            rng = self.rng
+            row_start, row_stop = 0, self.edge_size
+            infected_flat = self.infected_flat
         else:
-            n_dist = int(dist)
-            lower_list = self._generate_coordinate_list_(dim - 1, dist)
-            t_list = [ l + [i] for l in lower_list for i in range(-n_dist, n_dist + 1,1)]
-            list_index = [l for l in t_list if np.linalg.norm(np.array(l)) <= dist]
-            return  list_index
+            rng = self.tile_rngs[tile]
+            row_start, row_stop = self.tile_rows[tile], self.tile_rows[tile + 1]
+            row_stride = self.pop_size // self.edge_size
+            lo, hi = np.searchsorted(self.infected_flat, (row_start * row_stride, row_stop * row_stride))
+            infected_flat = self.infected_flat[lo:hi]
+        if profiler is not None:
+            tick = profiler.lap(LOOKUP, tick)
+        recovered_mask = bernoulli_mask(rng, len(infected_flat), self.prob_recover)
+        if profiler is not None:
+            tick = profiler.lap(RECOVER, tick)
+        if use_density:
+            targets = [self._density_infection_(row_start, row_stop, rng)]
+        else:
+            targets = self._local_infection_(infected_flat, rng)
+        if profiler is not None:
+            tick = profiler.lap(LOCAL, tick)
+        #Try long distance infections
+        targets.append(self._long_distance_infection_(infected_flat, rng))
+        if profiler is not None:
+            profiler.lap(LONG, tick)
+        return recovered_mask, targets
     #
-    #  The wrap function
+    #  The local infection kernel
     #
-    def _wrap_(self, max_val = None, indices = None):
-        """  This wraps the values so there are no negative indices or huge indices
-            NOTE:  This is the helper function that hides the multiple indices
+    def _local_infection_(self, infected_flat = None, rng = None):
+        '''  Finds the susceptible friends infected by the infected people for all offsets at once
 
         Input:
-            max_val : an integer for the lengthe of the mesh used in epidemic studies
-                NOTE:  Assumes that each dimension is the same
-                NOTE:  Assumes that 0 is always the lowest value
-            indices :  The indices to check  (as an numpy array)
-                NOTE:  These must have the same lengths
+            infected_flat - the flat lattice indices of the infected people
+            rng - the np.random.Generator for the draws
 
         Output:
-            A copy of the indices with the torus wrapped values
-        """
-        assert max_val is not None
-        assert max_val > 0
-        assert indices is not None
-        assert isinstance(indices,np.ndarray)
-        #  Usually the number of indices >= max_val or < 0 is small so
-        #  this is faster than using np.mod
-        w_indices = np.copy(indices)
-        large_indices = np.where(w_indices >= max_val)
-        w_indices[large_indices] = w_indices[large_indices] - max_val
-        small_indices = np.where(w_indices < 0)
-        w_indices[small_indices] = max_val + w_indices[small_indices]
-        return w_indices
-    #
-    #  Choose random subset of indices
-    #
-    def _choose_random_indices_(self, indices = None, q = None):
-        '''Choose a random subset of indices based upon 
+            A list of arrays of flat indices of susceptible people who are infected
+            NOTE:  A person can appear more than once; nothing is written here
+            NOTE:  There is one Bernoulli trial for every (infected, offset) pair,
+            numbered infected-major; the sampler only returns the successful
+            pairs, in chunks, so the draws scale with the infections
+        '''
+        num_offsets = len(self.table_offsets)
+        targets = []
+        for pairs in iter_bernoulli_indices(rng, len(infected_flat) * num_offsets, self.prob_local_infect):
+            infector, offset = np.divmod(pairs, num_offsets)
+            neighbors = self._neighbor_indices_(infected_flat[infector], offset)
+            targets.append(neighbors[self._is_susceptible_(neighbors)])
+        return targets
+    #
+    #  The whole lattice (stencil) local infection kernel
+    #
+    def _use_density_kernel_(self):
+        return self.people_state is not None and self.num_infected >= self.density_threshold * self.pop_size
+    def _density_infection_(self, row_start = None, row_stop = None, rng = None):
+        '''  Finds the susceptible people infected by their friends with a periodic stencil
 
         Input:
-            indices - The indices to choose
-            q - The value to compare the random number against for choice
+            row_start, row_stop - The rows (first lattice axis) of the lattice to update
+            rng - the np.random.Generator for the draws
 
         Output:
-            work_indices - An appropriate subset of indices
+            The flat indices of the susceptible people who are infected
+            NOTE:  Each susceptible person with k infected friends is infected with
+            probability 1-(1-prob_local_infect)^k, which is the same as the list kernel
+            NOTE:  The rows are taken from every replicate of the leading batch_shape
+            axes, and the stencil never crosses from one replicate to another
         '''
-        assert indices is not None
-        assert len(indices) > 0
-        assert q is not None
-        assert isinstance(q, np.float64)
-        assert q >= 0.0
-        assert q <= 1.0
-        num_indices = len(indices)
-        work_indices = [np.copy(indices[i]) for i in range(num_indices)]
-        len_indices = len(work_indices[0])
-        #only a single set of random numbers, then choose all the same positions
-        choose_indices = np.where(np.random.uniform(size=len_indices) < q)
-        if len(choose_indices) > 0:
-            infected_indices = [work_indices[i][choose_indices[0]] for i in range(num_indices)]
-            work_indices = tuple(infected_indices)
-        else:
-            work_indices = ()
-        return work_indices  
+        num_offsets = len(self.coord_array)
+        num_rows = row_stop - row_start
+        lead = len(self.batch_shape)
+        whole = (slice(None),) * lead
+        #  The infected mask of the rows plus a halo of reach rows, wrapped on every lattice axis
+        halo_rows = np.mod(np.arange(row_start - self.reach, row_stop + self.reach), self.edge_size)
+        padded = np.take(self.people_state, halo_rows, axis = lead) == self.I
+        padded = np.pad(padded, [(0, 0)] * (lead + 1) + [(self.reach, self.reach)] * (self.dim - 1), mode = 'wrap')
+        #  Count the infected friends of every person, one streaming pass per offset
+        tile_shape = (num_rows,) + self.lattice_shape[1:]
+        counts = np.zeros(self.batch_shape + tile_shape, dtype = np.min_scalar_type(num_offsets))
+        for c in self.coord_array:
+            if not np.any(c):
+                continue  # a person is not their own friend
+            window = whole + tuple([slice(self.reach + c[i], self.reach + c[i] + tile_shape[i]) for i in range(self.dim)])
+            np.add(counts, padded[window], out = counts)
+        #  The susceptible people with at least one infected friend
+        susceptible = self.people_state[whole + (slice(row_start, row_stop),)] == self.S
+        candidates = np.flatnonzero(np.logical_and(counts > 0, susceptible))
+        prob_table = 1.0 - (1.0 - self.prob_local_infect) ** np.arange(num_offsets + 1)
+        prob_infect = prob_table[counts.reshape(-1)[candidates]]
+        #  Move to lattice flat indices; these already are for the whole lattice
+        row_stride = self.pop_size // self.edge_size
+        if lead > 0 and num_rows < self.edge_size:
+            replicate, candidates = np.divmod(candidates, num_rows * row_stride)
+            candidates += replicate * self.pop_size
+        candidates += row_start * row_stride
+        return candidates[rng.random(size = len(candidates)) < prob_infect]
+    #
+    #  The long distance infection kernel
+    #
+    def _long_distance_infection_(self, infected_flat = None, rng = None):
+        '''  Finds the susceptible people infected outside the friend circles
+
+        Input:
+            infected_flat - the flat lattice indices of the infected people
+            rng - the np.random.Generator for the draws
+
+        Output:
+            The flat indices of the susceptible people who are infected
+            NOTE:  A person can appear more than once; nothing is written here
+        '''
+        #  One binomial draw counts the tries; targets are only drawn for them
+        num_chosen = bernoulli_count(rng, len(infected_flat), self.prob_long_dist_infect)
+        targets = rng.integers(self.pop_size, size = num_chosen)
+        return targets[self._is_susceptible_(targets)]
+    #
+    #  The pieces of a checkpoint that the sparse engine overrides
+    #
+    def _checkpoint_arrays_(self):
+        #  The last transitions feed get_last_transitions and the next log record
+        arrays = {'infected_flat': self.infected_flat, 'last_new_infected': self.last_new_infected,
+            'last_new_recovered': self.last_new_recovered}
+        if self.block_counts is not None:
+            arrays['block_counts'] = self.block_counts
+        return arrays
+    def _restore_arrays_(self, arrays = None):
+        self.infected_flat = arrays['infected_flat'].astype(np.intp)
+        self.last_new_infected = arrays['last_new_infected'].astype(np.intp)
+        self.last_new_recovered = arrays['last_new_recovered'].astype(np.intp)
+        if self.block_counts is not None:
+            assert arrays['block_counts'].shape == self.block_counts.shape
+            np.copyto(self.block_counts, arrays['block_counts'])
+    def _restore_lattice_(self, lattice_file = None):
+        assert lattice_file is not None
+        saved = np.load(lattice_file, mmap_mode = 'r')
+        assert saved.shape == self.lattice_shape
+        np.copyto(self.people_state, saved)
+    #
+    #  Lattice access used by the kernels; the sparse engine overrides these
+    #
+    def _is_susceptible_(self, flat = None):
+        return self.people_state.reshape(-1)[flat] == self.S
+    def _write_states_(self, flat = None, state = None):
+        self.people_state.reshape(-1)[flat] = state
+    #
+    #  Apply the transitions of a step
+    #
+    def _apply_transitions_(self, new_infected = None, recovered_mask = None, written = False):
+        '''  Writes the transitions of a step to the lattice, the counts and the infected index
+
+        Input:
+            new_infected - sorted unique flat indices of the newly infected people
+            recovered_mask - boolean mask over self.infected_flat of the recovered people
+            written - True when the kernel already wrote the lattice
+        '''
+        recovered_flat = self.infected_flat[recovered_mask]
+        if not written:
+            self._write_states_(new_infected, self.I)
+            self._write_states_(recovered_flat, self.R)
+        self._update_counts_(len(new_infected), len(recovered_flat))
+        self._update_infected_index_(new_infected, recovered_mask)
+        self.last_new_infected = new_infected
+        self.last_new_recovered = recovered_flat
+        if self.block_counts is not None:
+            self._update_block_counts_(new_infected, recovered_flat)
+    #
+    #  The coarse block counts
+    #
+    def _build_block_counts_(self):
+        '''  Builds the block counts from the infected index at the start of a run
+            NOTE:  Everyone who is not infected is susceptible at this point
+        '''
+        n_blocks = -(-self.edge_size // self.block_size)
+        self.block_shape = tuple([n_blocks for i in range(self.dim)])
+        #  The number of people in each block; the last block of an axis can be short
+        widths = np.full(n_blocks, self.block_size, dtype = np.int64)
+        widths[-1] = self.edge_size - (n_blocks - 1) * self.block_size
+        self.block_cells = widths
+        for i in range(1, self.dim):
+            self.block_cells = np.multiply.outer(self.block_cells, widths)
+        self.block_counts = np.zeros((3,) + self.block_shape, dtype = np.int64)
+        self.block_counts[0] = self.block_cells
+        self._update_block_counts_(self.infected_flat, np.empty(0, dtype = np.intp))
+    def _block_index_(self, flat = None):
+        '''  Returns the flat block index of flat lattice indices
+        '''
+        coords = np.unravel_index(flat, self.lattice_shape)
+        blocks = coords[0] // self.block_size
+        for i in range(1, self.dim):
+            blocks *= self.block_shape[i]
+            blocks += coords[i] // self.block_size
+        return blocks
+    def _update_block_counts_(self, new_infected = None, new_recovered = None):
+        '''  Moves the people that changed in a step between the block counts
+            NOTE:  np.add.at only touches the blocks of the changed people
+        '''
+        counts = self.block_counts.reshape(3, -1)
+        if len(new_infected) > 0:
+            blocks = self._block_index_(new_infected)
+            np.add.at(counts[0], blocks, -1)
+            np.add.at(counts[1], blocks, 1)
+        if len(new_recovered) > 0:
+            blocks = self._block_index_(new_recovered)
+            np.add.at(counts[1], blocks, -1)
+            np.add.at(counts[2], blocks, 1)
+    #
+    #  Torus neighbors of flat indices
+    #
+    def _neighbor_indices_(self, flat = None, offset = None):
+        '''  Finds the flat index of a torus neighbor with the cached wrap tables
+
+        Input:
+            flat - flat lattice indices, counting any leading batch_shape axes
+            offset - for each flat index, the row of self.coord_array to move by
+
+        Output:
+            The flat indices of the neighbors, in the same replicate as flat
+            NOTE:  Away from the edges a neighbor is flat plus the flat offset of
+            the stencil offset; only people within reach of an edge use the tables
+        '''
+        coords = np.unravel_index(flat, self.batch_shape + self.lattice_shape)[len(self.batch_shape):]
+        neighbors = flat + self.flat_offsets[offset]
+        boundary = np.zeros(len(neighbors), dtype = bool)
+        for i in range(self.dim):
+            boundary |= coords[i] < self.reach
+            boundary |= coords[i] >= self.edge_size - self.reach
+        edge = np.flatnonzero(boundary)
+        if len(edge) > 0:
+            edge_offset = offset[edge]
+            wrapped = self.torus_tables[0][coords[0][edge] + self.table_offsets[edge_offset, 0]]
+            for i in range(1, self.dim):
+                wrapped += self.torus_tables[i][coords[i][edge] + self.table_offsets[edge_offset, i]]
+            if len(self.batch_shape) > 0:
+                #  The first person of the replicate
+                wrapped += flat[edge] - flat[edge] % self.pop_size
+            neighbors[edge] = wrapped
+        return neighbors
+    #
+    #  Create Population  -  We always create a population with the approximate size
+    #
+    def _create_population_(self, n_dim = None, total_pop = None):
+        """  Creates the city population and initialize to the s_state
+
+        Inputs:
+            n_dim - number of dimensions of the lattice
+            total_pop - Approximate number of people
+
+        Outputs:
+            computed_pop - computed number of people to use
+            edge_size - The length of each edge in the lattice
+            pop_lattice - the state lattice (stored with self.state_dtype)
+        """
+        lattice_dim = int(n_dim)
+        edge_size = int(np.float64(total_pop)**(1./lattice_dim) + .5)
+        computed_pop = edge_size ** lattice_dim
+        lattice_struct = tuple([edge_size for i in range(lattice_dim)])
+        pop_lattice = self._allocate_lattice_(lattice_struct)
+        pop_lattice.fill(self.S)
+        return computed_pop, edge_size, pop_lattice
+    def _allocate_lattice_(self, lattice_struct = None):
+        '''  Allocates the (uninitialized) model lattice, on memmap_path if it is set
+            NOTE:  Allocated directly in the state dtype so there is no int64 temporary
+        '''
+        if self.memmap_path is None:
+            return np.empty(lattice_struct, dtype = self.state_dtype)
+        return np.memmap(self.memmap_path, dtype = self.state_dtype, mode = 'w+', shape = lattice_struct)
+    #
+    #  Generate the list of coordinates within d distance - We always create a coordinate list
+    #
+    def _generate_coordinate_list_(self, dim = None, dist = None):
+        '''  This generates the array of integer coordinates around 0,0 within a given euclidean distance
+            NOTE:  See _coordinate_list_ for the details
+        '''
+        return _coordinate_list_(dim, dist)
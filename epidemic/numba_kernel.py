@@ -0,0 +1,118 @@
+import importlib.util
+from epidemic.sampling import SKIP_BELOW
+#
+#  Optional Numba backend for the epidemic step
+#  NOTE:  Numba is not required; HAVE_NUMBA tells epidemic if the backend can be used.
+#  numba is only imported, and the kernels compiled, the first time the backend
+#  steps, so importing epidemic stays cheap (e.g. in ensemble worker processes)
+#
+HAVE_NUMBA = importlib.util.find_spec('numba') is not None
+#  The compiled _fused_step_, built by _compiled_fused_step_
+_COMPILED_STEP_ = None
+
+def _compiled_fused_step_():
+    '''  Returns _fused_step_ compiled with numba.njit, compiling it on the first call
+    '''
+    global _COMPILED_STEP_, _infect_pair_
+    if _COMPILED_STEP_ is None:
+        import numba
+        #  The helper is compiled first so the step resolves the compiled version
+        _infect_pair_ = numba.njit(cache = True)(_infect_pair_)
+        _COMPILED_STEP_ = numba.njit(cache = True)(_fused_step_)
+    return _COMPILED_STEP_
+
+def _fused_step_(lattice, infected_flat, tables, table_offsets, strides, edge_size,
+    pop_size, prob_recover, prob_local_infect, prob_long_dist_infect,
+    S, I, R, rng, recovered_mask, new_infected, batch_recover, batch_local):
+    '''  Recovery, local infection and long distance infection in one compiled loop
+
+    Input:
+        lattice - the flat lattice, updated in place
+        infected_flat - the sorted flat indices of the infected people
+        tables - (dim, edge_size + 2 reach) stacked torus wrap tables
+        table_offsets - (K, dim) stencil offsets shifted by reach
+        strides - the flat stride of every axis
+        edge_size, pop_size - the lattice sizes
+        prob_recover, prob_local_infect, prob_long_dist_infect - the probabilities
+        S, I, R - the states, in the lattice dtype
+        rng - the np.random.Generator of the model
+        recovered_mask - output, set for the infected people who recover
+        new_infected - output buffer with room for len(infected_flat) * (K + 1) indices
+        batch_recover, batch_local - the skip_batch_size of the recovery and the
+            local (infected, offset) trials
+
+    Output:
+        The number of newly infected people written to new_infected
+        NOTE:  The draws are made in the same order and in the same batches as
+        epidemic.sampling in the NumPy list kernel (the recovery trials, then the
+        (infected, offset) trials, then the binomial count of long distance
+        trials and their targets), so with the same Generator both backends take
+        the same path.  A person is written as infected as soon as they are
+        reached, so they are never counted twice.
+    '''
+    num_infected = len(infected_flat)
+    num_offsets = table_offsets.shape[0]
+    recovered_mask[:] = False
+    if num_infected > 0 and prob_recover > 0.0:
+        if prob_recover >= SKIP_BELOW:
+            for i in range(num_infected):
+                if rng.random() < prob_recover:
+                    recovered_mask[i] = True
+        else:
+            last = -1
+            done = False
+            while not done:
+                #  Whole batches are drawn, as in the NumPy sampler
+                for j in range(batch_recover):
+                    last += rng.geometric(prob_recover)
+                    if not done:
+                        if last < num_infected:
+                            recovered_mask[last] = True
+                        else:
+                            done = True
+    num_new = 0
+    num_pairs = num_infected * num_offsets
+    if num_pairs > 0 and prob_local_infect > 0.0:
+        if prob_local_infect >= SKIP_BELOW:
+            for pair in range(num_pairs):
+                if rng.random() < prob_local_infect:
+                    num_new = _infect_pair_(lattice, infected_flat[pair // num_offsets], pair % num_offsets,
+                        tables, table_offsets, strides, edge_size, S, I, new_infected, num_new)
+        else:
+            last = -1
+            done = False
+            while not done:
+                for j in range(batch_local):
+                    last += rng.geometric(prob_local_infect)
+                    if not done:
+                        if last < num_pairs:
+                            num_new = _infect_pair_(lattice, infected_flat[last // num_offsets], last % num_offsets,
+                                tables, table_offsets, strides, edge_size, S, I, new_infected, num_new)
+                        else:
+                            done = True
+    num_chosen = 0
+    if num_infected > 0 and prob_long_dist_infect > 0.0:
+        num_chosen = rng.binomial(num_infected, prob_long_dist_infect)
+    for j in range(num_chosen):
+        target = rng.integers(0, pop_size)
+        if lattice[target] == S:
+            lattice[target] = I
+            new_infected[num_new] = target
+            num_new += 1
+    for i in range(num_infected):
+        if recovered_mask[i]:
+            lattice[infected_flat[i]] = R
+    return num_new
+
+def _infect_pair_(lattice, flat, k, tables, table_offsets, strides, edge_size, S, I, new_infected, num_new):
+    '''  Infects the friend at stencil offset k of the person at flat if they are susceptible
+        NOTE:  Returns the updated number of newly infected people
+    '''
+    target = 0
+    for a in range(tables.shape[0]):
+        target += tables[a, (flat // strides[a]) % edge_size + table_offsets[k, a]]
+    if lattice[target] == S:
+        lattice[target] = I
+        new_infected[num_new] = target
+        num_new += 1
+    return num_new
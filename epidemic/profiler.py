@@ -0,0 +1,125 @@
+import threading
+import tracemalloc
+import numpy as np
+from time import perf_counter
+from epidemic.ring_buffer import ring_buffer
+#  The phases of a step that are timed
+#    lookup - selecting the infected people of every strip from the sorted index
+#    recover - the recovery draws
+#    local - the local infection kernel (all stencil offsets are drawn together)
+#    long - the long distance infection kernel
+#    merge - joining the targets of the strips into the unique newly infected
+#    kernel - the whole compiled (numba) or torch step, which has no inner phases
+#    write - writing the lattice, the running counts and the infected index
+PHASES = ('lookup', 'recover', 'local', 'long', 'merge', 'kernel', 'write')
+#  Phase numbers for the lap calls of the model
+LOOKUP, RECOVER, LOCAL, LONG, MERGE, KERNEL, WRITE = range(len(PHASES))
+#  One record per step
+profile_dtype = np.dtype([('time', np.int64), ('total', np.float64)] +
+    [(p, np.float64) for p in PHASES] +
+    [('infected', np.int64), ('new_infected', np.int64), ('new_recovered', np.int64),
+     ('alloc_bytes', np.int64)])
+#
+#  Per phase timing of epidemic steps
+#
+class step_profiler():
+    """  This class records the wall time of the phases of every step, the event
+    counts and (optionally) the bytes allocated, in a ring_buffer of numeric
+    records.  An epidemic model only calls it when profiling is enabled, so a
+    model without a profiler pays nothing.
+
+    Inputs -
+        capacity - The number of steps kept (default 4096)
+        trace_memory - If True, tracemalloc records the peak bytes allocated
+            during every step (default False)
+            NOTE:  tracemalloc slows every allocation, so the phase times are
+            larger when it is on
+    """
+    #
+    def __init__(self, capacity = None, trace_memory = None):
+        self.records = ring_buffer(profile_dtype, 4096 if capacity is None else capacity)
+        self.trace_memory = bool(trace_memory)
+        self.started_tracing = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        #  The phase times of the current step; the strips of a threaded step add concurrently
+        self.phase_times = np.zeros(len(PHASES), dtype = np.float64)
+        self.lock = threading.Lock()
+        self.step_start = None
+        self.alloc_start = 0
+        self.time = None
+        self.infected = None
+    ######################################################
+    #  The functions called by the model
+    ######################################################
+    def begin_step(self, time = None, infected = None):
+        self.phase_times.fill(0.0)
+        self.time = time
+        self.infected = infected
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self.alloc_start = tracemalloc.get_traced_memory()[0]
+        self.step_start = perf_counter()
+    def lap(self, phase = None, start = None):
+        '''  Adds the time since start to a phase and returns the current time
+        '''
+        now = perf_counter()
+        with self.lock:
+            self.phase_times[phase] += now - start
+        return now
+    def end_step(self, new_infected = None, new_recovered = None):
+        total = perf_counter() - self.step_start
+        alloc_bytes = 0
+        if self.trace_memory:
+            alloc_bytes = tracemalloc.get_traced_memory()[1] - self.alloc_start
+        self.records.append((self.time, total) + tuple(self.phase_times) +
+            (self.infected, new_infected, new_recovered, alloc_bytes))
+    def stop(self):
+        '''  Stops tracemalloc if this profiler started it
+        '''
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+    ######################################################
+    #  The public functions
+    ######################################################
+    def get_records(self):
+        '''  Returns the kept step records (a profile_dtype array), oldest first
+        '''
+        return self.records.records()
+    def summary(self):
+        '''  Summarizes the kept steps
+
+        Output:
+            A dictionary with
+                steps - the number of steps summarized
+                total - the total step time in seconds
+                phases - phase -> {'total', 'mean', 'fraction'} where fraction is
+                    the share of the total step time
+                NOTE:  The time that is in no phase (e.g. the step bookkeeping)
+                is reported as 'other'; in a threaded step the strip phases are
+                summed over the threads, so they can add up to more than the step
+                events - {'infected', 'new_infected', 'new_recovered'} means per step
+                alloc_bytes - {'mean', 'max'} per step (zeros without trace_memory)
+        '''
+        records = self.get_records()
+        steps = len(records)
+        total = float(records['total'].sum())
+        phases = {}
+        for p in PHASES + ('other',):
+            if p == 'other':
+                seconds = total - sum([phases[q]['total'] for q in PHASES])
+            else:
+                seconds = float(records[p].sum())
+            phases[p] = {'total': seconds, 'mean': seconds / max(steps, 1),
+                'fraction': seconds / total if total > 0.0 else 0.0}
+        return {
+            'steps': steps,
+            'total': total,
+            'phases': phases,
+            'events': dict([(e, float(records[e].mean()) if steps > 0 else 0.0)
+                for e in ('infected', 'new_infected', 'new_recovered')]),
+            'alloc_bytes': {'mean': float(records['alloc_bytes'].mean()) if steps > 0 else 0.0,
+                'max': int(records['alloc_bytes'].max()) if steps > 0 else 0},
+        }
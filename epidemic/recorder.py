@@ -0,0 +1,189 @@
+import numpy as np
+#
+#  Delta encoded trajectories of the epidemic model
+#
+class trajectory_recorder():
+    """  This class records a run of an epidemic model as the flat indices that
+    change in every step (S->I and I->R) instead of copying the lattice, so the
+    storage grows with the number of events rather than the lattice size.  A copy
+    of the lattice (a keyframe) is kept every keyframe_every steps so that the
+    replayer can seek to any step quickly.
+
+    Inputs -
+        model - The epidemic model to record; recording starts at its current time
+        keyframe_every - The number of steps between keyframes (default 100)
+            NOTE:  None or 0 keeps only the starting lattice
+        chunk_size - The number of events gathered before they are packed into
+            one compact array (default 2**16)
+
+    Usage -
+        recorder = trajectory_recorder(model)
+        recorder.run(500)          # or model.single_time_step(); recorder.record()
+        recorder.save('run.npz')   # compressed on disk
+        lattice = trajectory_replayer('run.npz').lattice_at(250)
+    """
+    #
+    def __init__(self, model = None, keyframe_every = None, chunk_size = None):
+        assert model is not None
+        self.model = model
+        self.keyframe_every = 100 if keyframe_every is None else int(keyframe_every)
+        self.chunk_size = 2**16 if chunk_size is None else int(chunk_size)
+        assert self.chunk_size > 0
+        pop_size = model.get_population_size()
+        self.index_dtype = np.int32 if pop_size <= np.iinfo(np.int32).max else np.int64
+        self.state_dtype = model.state_dtype
+        self.states = (model.S, model.I, model.R)
+        self.lattice_shape = model.lattice_shape
+        self.start_time = model.current_time
+        self.last_time = model.current_time
+        #  Events are kept in packed chunks plus a list of pending per step arrays
+        self.infected = _event_store_(self.index_dtype, self.chunk_size)
+        self.recovered = _event_store_(self.index_dtype, self.chunk_size)
+        self.keyframe_times = [self.start_time]
+        self.keyframes = [np.array(model.get_people_state(), dtype = self.state_dtype)]
+    ######################################################
+    #  The public functions
+    ######################################################
+    def get_number_of_steps(self):
+        return self.last_time - self.start_time
+    def get_number_of_events(self):
+        return self.infected.size() + self.recovered.size()
+    def record(self):
+        '''  Records the transitions of the last step of the model
+            NOTE:  Nothing is recorded if the model time did not move
+        '''
+        if self.model.current_time == self.last_time:
+            return
+        assert self.model.current_time == self.last_time + 1
+        new_infected, new_recovered = self.model.get_last_transitions()
+        self.infected.append(new_infected)
+        self.recovered.append(new_recovered)
+        self.last_time = self.model.current_time
+        if self.keyframe_every > 0 and (self.last_time - self.start_time) % self.keyframe_every == 0:
+            self.keyframe_times.append(self.last_time)
+            self.keyframes.append(np.array(self.model.get_people_state(), dtype = self.state_dtype))
+    def run(self, n_steps = None):
+        '''  Steps the model up to n_steps times, recording every step
+            NOTE:  Stops early when no one is infected
+        '''
+        assert n_steps is not None
+        for i in range(n_steps):
+            if self.model.get_number_infected() == 0:
+                break
+            self.model.single_time_step()
+            self.record()
+    def save(self, path = None, compressed = True):
+        '''  Saves the recording to an .npz file, compressed by default
+        '''
+        assert path is not None
+        writer = np.savez_compressed if compressed else np.savez
+        writer(path, **self._arrays_())
+    def replayer(self):
+        return trajectory_replayer(self)
+    ######################################################
+    #  The private functions
+    ######################################################
+    def _arrays_(self):
+        infected_events, infected_offsets = self.infected.packed()
+        recovered_events, recovered_offsets = self.recovered.packed()
+        return {
+            'start_time': np.array(self.start_time),
+            'states': np.array(self.states, dtype = self.state_dtype),
+            'infected_events': infected_events,
+            'infected_offsets': infected_offsets,
+            'recovered_events': recovered_events,
+            'recovered_offsets': recovered_offsets,
+            'keyframe_times': np.array(self.keyframe_times, dtype = np.int64),
+            'keyframes': np.stack(self.keyframes),
+        }
+#
+#  Rebuild the lattice of a recorded run
+#
+class trajectory_replayer():
+    """  This class rebuilds the lattice of a recorded run at any step
+
+    Inputs -
+        source - A trajectory_recorder or the path of a file it saved
+    """
+    #
+    def __init__(self, source = None):
+        assert source is not None
+        if isinstance(source, trajectory_recorder):
+            arrays = source._arrays_()
+        else:
+            with np.load(source) as data:
+                arrays = dict([(k, data[k]) for k in data.files])
+        self.start_time = int(arrays['start_time'])
+        self.S, self.I, self.R = arrays['states']
+        self.infected_events = arrays['infected_events']
+        self.infected_offsets = arrays['infected_offsets']
+        self.recovered_events = arrays['recovered_events']
+        self.recovered_offsets = arrays['recovered_offsets']
+        self.keyframe_times = arrays['keyframe_times']
+        self.keyframes = arrays['keyframes']
+    def get_times(self):
+        return np.arange(self.start_time, self.start_time + len(self.infected_offsets))
+    def get_transitions(self, time = None):
+        '''  Returns the flat indices that became infected and recovered in the step ending at time
+        '''
+        step = time - self.start_time
+        assert 1 <= step < len(self.infected_offsets)
+        return (self.infected_events[self.infected_offsets[step - 1]:self.infected_offsets[step]],
+            self.recovered_events[self.recovered_offsets[step - 1]:self.recovered_offsets[step]])
+    def lattice_at(self, time = None, out = None):
+        '''  Rebuilds the lattice at the given time
+
+        Input:
+            time - The model time to rebuild
+            out - Optional lattice to write into (saves the allocation when animating)
+
+        Output:
+            The lattice at that time
+            NOTE:  Starts from the last keyframe at or before time and applies
+            only the events after it
+        '''
+        assert time is not None
+        step = time - self.start_time
+        assert 0 <= step < len(self.infected_offsets)
+        k = np.searchsorted(self.keyframe_times, time, side = 'right') - 1
+        if out is None:
+            out = np.empty(self.keyframes.shape[1:], dtype = self.keyframes.dtype)
+        np.copyto(out, self.keyframes[k])
+        first = self.keyframe_times[k] - self.start_time
+        flat = out.reshape(-1)
+        #  The events of a state can be applied in one scatter; a person recovers
+        #  only after they were infected, so the recovered scatter goes last
+        flat[self.infected_events[self.infected_offsets[first]:self.infected_offsets[step]]] = self.I
+        flat[self.recovered_events[self.recovered_offsets[first]:self.recovered_offsets[step]]] = self.R
+        return out
+#
+#  Growing store of events in compact chunks
+#
+class _event_store_():
+    '''  Keeps the per step event arrays in packed chunks of one integer dtype
+    '''
+    def __init__(self, index_dtype = None, chunk_size = None):
+        self.index_dtype = index_dtype
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.pending = []
+        self.num_pending = 0
+        #  offsets[t] is the number of events before step t + 1
+        self.offsets = [0]
+    def append(self, events = None):
+        self.pending.append(np.asarray(events, dtype = self.index_dtype))
+        self.num_pending += len(events)
+        self.offsets.append(self.offsets[-1] + len(events))
+        if self.num_pending >= self.chunk_size:
+            self._pack_()
+    def size(self):
+        return self.offsets[-1]
+    def packed(self):
+        self._pack_()
+        events = np.concatenate(self.chunks) if len(self.chunks) > 0 else np.empty(0, dtype = self.index_dtype)
+        return events, np.array(self.offsets, dtype = np.int64)
+    def _pack_(self):
+        if len(self.pending) > 0:
+            self.chunks.append(np.concatenate(self.pending))
+            self.pending = []
+            self.num_pending = 0
@@ -0,0 +1,167 @@
+import zlib
+import struct
+import numpy as np
+#
+#  Fast frames of the epidemic lattice for animations
+#
+class frame_renderer():
+    """  This class turns the lattice of an epidemic model into RGB frames
+    without matplotlib.  The lattice is block downsampled to the target size and
+    the states are mapped to colors with a palette lookup table, writing into a
+    preallocated uint8 buffer that is reused for every frame.
+
+    Inputs -
+        edge_size - The edge size of the (2D) lattice
+        target_size - The largest edge of the frame in pixels (default edge_size)
+            NOTE:  Each pixel covers a block of ceil(edge_size / target_size) cells
+            on a side, so the frame is never larger than target_size; the rows
+            and columns that do not fill a whole block are left out
+        palette - (3, 3) uint8 RGB colors for S, I and R (default white, red, gray)
+        mode - 'majority' colors a pixel by the most common state of its block;
+            'fraction' mixes the colors by the fraction of each state (default 'majority')
+
+    Usage -
+        renderer = frame_renderer(model.get_edge_size(), 512)
+        with open('run.rgb', 'wb') as stream:
+            for record in model.iter_steps(500):
+                renderer.write_raw(stream, renderer.render(record.people_state))
+    """
+    #
+    def __init__(self, edge_size = None, target_size = None, palette = None, mode = None):
+        assert edge_size is not None
+        self.edge_size = int(edge_size)
+        target_size = self.edge_size if target_size is None else int(target_size)
+        assert 0 < target_size <= self.edge_size
+        self.block = -(-self.edge_size // target_size)
+        self.size = self.edge_size // self.block
+        self.mode = 'majority' if mode is None else mode
+        assert self.mode in ('majority', 'fraction')
+        self.palette = np.array([[255, 255, 255], [214, 39, 40], [127, 127, 127]] if palette is None else palette,
+            dtype = np.uint8)
+        assert self.palette.shape == (3, 3)
+        #  The buffers reused by every frame
+        n, b = self.size, self.block
+        self.frame = np.empty((n, n, 3), dtype = np.uint8)
+        self.index = np.empty((n, n), dtype = np.uint8)
+        self.best = np.empty((n, n), dtype = np.min_scalar_type(b * b))
+        self.wins = np.empty((n, n), dtype = bool)
+        self.mask = np.empty((n * b, n * b), dtype = bool)
+        self.count_dtype = np.min_scalar_type(b * b)
+        self.row_counts = np.empty((n, n * b), dtype = self.count_dtype)
+        self.counts = np.empty((3, n, n), dtype = self.count_dtype)
+        #  The color mixing buffers of the 'fraction' mode
+        self.mixed = None
+        self.scratch = None
+        if self.mode == 'fraction':
+            self.mixed = np.empty((n, n, 3), dtype = np.float32)
+            self.scratch = np.empty((n, n, 3), dtype = np.float32)
+            self.palette_weights = self.palette.astype(np.float32) / (b * b)
+        self.png_rows = np.zeros((n, 1 + 3 * n), dtype = np.uint8)  # leading 0 is the PNG filter byte
+    ######################################################
+    #  The public functions
+    ######################################################
+    def get_frame_size(self):
+        return self.size
+    def render(self, people_state = None, out = None):
+        '''  Renders a lattice into an RGB frame
+
+        Input:
+            people_state - The (edge_size, edge_size) lattice of S/I/R states (0, 1, 2)
+            out - Optional (size, size, 3) uint8 buffer (default the renderer buffer)
+
+        Output:
+            The RGB frame
+            NOTE:  The default buffer is overwritten by the next frame
+        '''
+        out = self.frame if out is None else out
+        if self.block == 1:
+            np.take(self.palette, people_state, axis = 0, out = out)
+            return out
+        self._block_counts_(people_state)
+        if self.mode == 'majority':
+            np.take(self.palette, self.render_index(people_state, counted = True), axis = 0, out = out)
+        else:
+            np.multiply(self.counts[0][..., None], self.palette_weights[0], out = self.mixed)
+            for state in (1, 2):
+                np.multiply(self.counts[state][..., None], self.palette_weights[state], out = self.scratch)
+                self.mixed += self.scratch
+            np.rint(self.mixed, out = self.mixed)
+            np.copyto(out, self.mixed, casting = 'unsafe')
+        return out
+    def render_index(self, people_state = None, counted = False):
+        '''  Returns the majority state of every block as a (size, size) uint8 array
+            NOTE:  Ties go to the earlier state (S, then I, then R)
+        '''
+        if self.block == 1:
+            np.copyto(self.index, people_state, casting = 'unsafe')
+            return self.index
+        if not counted:
+            self._block_counts_(people_state)
+        #  Two elementwise comparisons instead of an argmax over the short state axis
+        np.greater(self.counts[1], self.counts[0], out = self.wins)
+        np.copyto(self.index, self.wins, casting = 'unsafe')
+        np.maximum(self.counts[0], self.counts[1], out = self.best)
+        np.greater(self.counts[2], self.best, out = self.wins)
+        np.copyto(self.index, 2, where = self.wins, casting = 'unsafe')
+        return self.index
+    def write_raw(self, stream = None, frame = None):
+        '''  Writes a frame as raw rgb24 bytes (e.g. to an ffmpeg pipe or a .rgb file)
+        '''
+        stream.write(memoryview(self.frame if frame is None else frame))
+    def write_png(self, stream = None, frame = None, level = 1):
+        '''  Writes a frame as a PNG file to a binary stream or a path
+            NOTE:  level is the zlib level; 1 is fast and compresses lattices well
+        '''
+        frame = self.frame if frame is None else frame
+        self.png_rows[:, 1:] = frame.reshape(self.size, -1)
+        header = struct.pack('>IIBBBBB', self.size, self.size, 8, 2, 0, 0, 0)
+        data = b'\x89PNG\r\n\x1a\n' + _png_chunk_(b'IHDR', header) + \
+            _png_chunk_(b'IDAT', zlib.compress(self.png_rows, level)) + _png_chunk_(b'IEND', b'')
+        if isinstance(stream, str):
+            with open(stream, 'wb') as f:
+                f.write(data)
+        else:
+            stream.write(data)
+    def save_gif(self, path = None, index_frames = None, duration = None):
+        '''  Saves frames from render_index as an animated GIF (needs Pillow)
+
+        Input:
+            path - The GIF file
+            index_frames - list of (size, size) arrays from render_index (copy each one)
+            duration - milliseconds per frame (default 50)
+        '''
+        from PIL import Image
+        palette = self.palette.reshape(-1).tolist()
+        images = []
+        for index in index_frames:
+            image = Image.fromarray(index, mode = 'P')
+            image.putpalette(palette)
+            images.append(image)
+        images[0].save(path, save_all = True, append_images = images[1:], loop = 0,
+            duration = 50 if duration is None else duration)
+    ######################################################
+    #  The private functions
+    ######################################################
+    def _block_counts_(self, people_state = None):
+        '''  Counts the cells of every state in every block into self.counts
+        '''
+        n, b = self.size, self.block
+        trimmed = people_state[:n * b, :n * b]
+        for state in (1, 2):
+            np.equal(trimmed, state, out = self.mask)
+            #  Add the b row slices of every block (contiguous rows), then the b
+            #  strided column slices of the b times smaller result; each add
+            #  streams a whole slice instead of reducing a short strided axis
+            np.copyto(self.row_counts, self.mask[0::b])
+            for k in range(1, b):
+                np.add(self.row_counts, self.mask[k::b], out = self.row_counts)
+            np.copyto(self.counts[state], self.row_counts[:, 0::b])
+            for k in range(1, b):
+                np.add(self.counts[state], self.row_counts[:, k::b], out = self.counts[state])
+        np.subtract(b * b, self.counts[1], out = self.counts[0], dtype = self.count_dtype)
+        self.counts[0] -= self.counts[2]
+#
+#  A PNG chunk
+#
+def _png_chunk_(kind = None, data = None):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
@@ -0,0 +1,66 @@
+import numpy as np
+#
+#  Fixed capacity buffer of numeric records
+#
+class ring_buffer():
+    """  This class keeps the last capacity records of a numpy structured dtype in
+    one preallocated array, so a long run uses bounded memory and appending
+    does not allocate.
+
+    Inputs -
+        dtype - The numpy (structured) dtype of a record
+        capacity - The number of records kept; older records are overwritten
+
+    Usage -
+        buffer = ring_buffer(np.dtype([('time', np.int64), ('value', np.float64)]), 1000)
+        buffer.append((t, v))
+        records = buffer.records()   # oldest first
+    """
+    #
+    def __init__(self, dtype = None, capacity = None):
+        assert dtype is not None
+        assert capacity is not None
+        assert capacity > 0
+        self.capacity = int(capacity)
+        self.buffer = np.zeros(self.capacity, dtype = dtype)
+        #  The number of records ever appended
+        self.count = 0
+    ######################################################
+    #  The public functions
+    ######################################################
+    def __len__(self):
+        return min(self.count, self.capacity)
+    def get_capacity(self):
+        return self.capacity
+    def get_total(self):
+        '''  Returns the number of records ever appended, including the overwritten ones
+        '''
+        return self.count
+    def append(self, record = None):
+        self.buffer[self.count % self.capacity] = record
+        self.count += 1
+    def last(self):
+        assert self.count > 0
+        return self.buffer[(self.count - 1) % self.capacity]
+    def records(self):
+        '''  Returns a copy of the kept records, oldest first
+        '''
+        if self.count <= self.capacity:
+            return self.buffer[:self.count].copy()
+        start = self.count % self.capacity
+        return np.concatenate((self.buffer[start:], self.buffer[:start]))
+    def clear(self):
+        self.count = 0
+    ######################################################
+    #  Saving and loading the buffer (e.g. in a checkpoint)
+    ######################################################
+    def get_state(self):
+        return self.records(), self.count
+    def set_state(self, records = None, count = None):
+        '''  Refills the buffer from get_state
+            NOTE:  Only the newest records fit when the capacity is smaller
+        '''
+        records = records[max(0, len(records) - self.capacity):]
+        self.count = count - len(records)
+        for record in records:
+            self.append(record)
@@ -0,0 +1,86 @@
+import numpy as np
+#
+#  Sampling of Bernoulli trials that scales with the number of successes
+#
+#  NOTE:  A geometric gap costs about as much as four uniforms, so skipping pays
+#  off below this probability; above it every trial gets one uniform
+SKIP_BELOW = 0.25
+#  The most random numbers drawn in one bulk call
+MAX_BATCH = 1 << 20
+
+def skip_batch_size(n_trials = None, prob = None):
+    '''  Returns the number of geometric gaps drawn per bulk call
+
+    Input:
+        n_trials - The number of Bernoulli trials
+        prob - The success probability
+
+    Output:
+        The batch size, four standard deviations above the expected number of
+        successes so one batch almost always covers all the trials
+        NOTE:  The compiled kernel draws whole batches too, which keeps its
+        random stream the same as the numpy one
+    '''
+    mean = n_trials * prob
+    return int(min(MAX_BATCH, mean + 4.0 * np.sqrt(mean * (1.0 - prob)) + 16))
+
+def iter_bernoulli_indices(rng = None, n_trials = None, prob = None):
+    '''  Yields the sorted indices of the successes of n_trials Bernoulli trials
+
+    Input:
+        rng - The np.random.Generator for the draws
+        n_trials - The number of trials
+        prob - The success probability
+
+    Output:
+        Arrays of increasing trial indices, at most MAX_BATCH at a time
+        NOTE:  Below SKIP_BELOW the successes are reached by geometric gaps, so
+        only about n_trials * prob random numbers are drawn; otherwise the
+        uniforms are drawn in bulk chunks of MAX_BATCH
+    '''
+    n_trials = int(n_trials)
+    if n_trials == 0 or prob <= 0.0:
+        return
+    if prob >= SKIP_BELOW:
+        for start in range(0, n_trials, MAX_BATCH):
+            yield start + np.flatnonzero(rng.random(size = min(MAX_BATCH, n_trials - start)) < prob)
+        return
+    batch = skip_batch_size(n_trials, prob)
+    last = -1
+    while True:
+        positions = np.cumsum(rng.geometric(prob, size = batch))
+        positions += last
+        inside = positions[:np.searchsorted(positions, n_trials)]
+        yield inside
+        if len(inside) < batch:
+            return
+        last = positions[-1]
+
+def bernoulli_indices(rng = None, n_trials = None, prob = None):
+    '''  Returns the sorted indices of the successes of n_trials Bernoulli trials
+        NOTE:  See iter_bernoulli_indices
+    '''
+    chunks = list(iter_bernoulli_indices(rng, n_trials, prob))
+    if len(chunks) == 0:
+        return np.empty(0, dtype = np.intp)
+    return np.concatenate(chunks).astype(np.intp, copy = False)
+
+def bernoulli_mask(rng = None, n_trials = None, prob = None):
+    '''  Returns a boolean mask of the successes of n_trials Bernoulli trials
+    '''
+    mask = np.zeros(int(n_trials), dtype = bool)
+    mask[bernoulli_indices(rng, n_trials, prob)] = True
+    return mask
+
+def bernoulli_count(rng = None, n_trials = None, prob = None):
+    '''  Returns the number of successes of n_trials Bernoulli trials with one binomial draw
+        NOTE:  n_trials can be an array (e.g. one count per replicate), which
+        gives an array of counts
+    '''
+    if np.ndim(n_trials) > 0:
+        if prob <= 0.0:
+            return np.zeros(np.shape(n_trials), dtype = np.int64)
+        return rng.binomial(n_trials, prob)
+    if n_trials == 0 or prob <= 0.0:
+        return 0
+    return int(rng.binomial(n_trials, prob))
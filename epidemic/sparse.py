@@ -0,0 +1,134 @@
+import numpy as np
+from epidemic.epidemic_class import epidemic
+#
+#  The epidemic model for populations with a low prevalence
+#
+class sparse_epidemic(epidemic):
+    """  This class has the same public interface as epidemic, but while the
+    prevalence is low it only stores the sorted flat indices of the infected
+    and recovered people; everyone else is susceptible.  This allows huge
+    populations (e.g. 10^5 x 10^5) that do not fit as a dense lattice.
+
+    Once the infected fraction of the population reaches dense_threshold, or
+    the stored indices take as much memory as the dense lattice would (a late
+    epidemic with many recovered people), the model builds the dense lattice
+    and continues exactly as epidemic.  The dense lattice honours memmap_path.
+    NOTE:  A model with the same seed takes the same path as epidemic; only the
+    storage differs.  The people_state of the records of iter_steps is None
+    until the model is dense, since building a lattice every step would defeat
+    the sparse storage.
+
+    Inputs -
+        dense_threshold - The infected fraction that switches to the dense
+            lattice (default 0.01); None keeps the default and 1.0 never switches
+        The remaining inputs are the same as for epidemic
+    """
+    #
+    def __init__(self, *args, dense_threshold = None, **kwargs):
+        self.dense_threshold = 0.01 if dense_threshold is None else dense_threshold
+        assert self._check_prob_(self.dense_threshold)
+        #  The sorted flat indices of the recovered people (sparse storage only)
+        self.recovered_flat = np.empty(0, dtype = np.intp)
+        super(sparse_epidemic, self).__init__(*args, **kwargs)
+    ######################################################
+    #  The public functions
+    ######################################################
+    def is_dense(self):
+        return self.people_state is not None
+    def get_recovered_indices(self):
+        if self.is_dense():
+            return np.flatnonzero(self.people_state == self.R)
+        return self.recovered_flat
+    def get_people_state(self):
+        '''  Returns the lattice of states
+            NOTE:  While the storage is sparse this builds a new dense lattice
+        '''
+        if self.is_dense():
+            return self.people_state
+        return self._dense_lattice_()
+    ######################################################
+    #  The private functions
+    ######################################################
+    def _create_population_(self, n_dim = None, total_pop = None):
+        '''  Computes the population size without allocating the lattice
+            NOTE:  The lattice (on memmap_path if it is set) is allocated by _densify_
+        '''
+        lattice_dim = int(n_dim)
+        edge_size = int(np.float64(total_pop)**(1./lattice_dim) + .5)
+        return edge_size ** lattice_dim, edge_size, None
+    def _checkpoint_arrays_(self):
+        arrays = super(sparse_epidemic, self)._checkpoint_arrays_()
+        arrays['recovered_flat'] = self.recovered_flat
+        return arrays
+    def _restore_arrays_(self, arrays = None):
+        super(sparse_epidemic, self)._restore_arrays_(arrays)
+        self.recovered_flat = arrays['recovered_flat'].astype(np.intp)
+    def _restore_lattice_(self, lattice_file = None):
+        if lattice_file is None:
+            self.people_state = None
+            return
+        if not self.is_dense():
+            self.people_state = self._allocate_lattice_(self.lattice_shape)
+        super(sparse_epidemic, self)._restore_lattice_(lattice_file)
+    def _count_people_states_(self):
+        if self.is_dense():
+            return super(sparse_epidemic, self)._count_people_states_()
+        num_infected = len(self.infected_flat)
+        num_recovered = len(self.recovered_flat)
+        return self.pop_size - num_infected - num_recovered, num_infected, num_recovered
+    #
+    #  Lattice access used by the kernels
+    #
+    def _is_susceptible_(self, flat = None):
+        if self.is_dense():
+            return super(sparse_epidemic, self)._is_susceptible_(flat)
+        return np.logical_not(np.logical_or(_is_member_(self.infected_flat, flat),
+            _is_member_(self.recovered_flat, flat)))
+    def _write_states_(self, flat = None, state = None):
+        if self.is_dense():
+            super(sparse_epidemic, self)._write_states_(flat, state)
+        elif state == self.R:
+            flat = np.sort(flat)
+            self.recovered_flat = np.insert(self.recovered_flat, np.searchsorted(self.recovered_flat, flat), flat)
+        #  The infected people are stored in self.infected_flat, which the step maintains
+    def _apply_transitions_(self, new_infected = None, recovered_mask = None, written = False):
+        super(sparse_epidemic, self)._apply_transitions_(new_infected, recovered_mask, written)
+        if not self.is_dense() and (self.num_infected >= self.dense_threshold * self.pop_size or
+            self._sparse_bytes_() >= self.pop_size * self.state_dtype.itemsize):
+            self._densify_()
+    #
+    #  Switch to the dense lattice
+    #
+    def _sparse_bytes_(self):
+        return (len(self.infected_flat) + len(self.recovered_flat)) * self.infected_flat.itemsize
+    def _densify_(self):
+        self.people_state = self._dense_lattice_(self._allocate_lattice_(self.lattice_shape))
+        self.recovered_flat = np.empty(0, dtype = np.intp)
+    def _dense_lattice_(self, lattice = None):
+        '''  Fills a lattice (a new array by default) from the sparse storage
+        '''
+        if lattice is None:
+            lattice = np.empty(self.lattice_shape, dtype = self.state_dtype)
+        lattice.fill(self.S)
+        flat_lattice = lattice.reshape(-1)
+        flat_lattice[self.infected_flat] = self.I
+        flat_lattice[self.recovered_flat] = self.R
+        return lattice
+#
+#  Membership in a sorted index array
+#
+def _is_member_(sorted_flat = None, flat = None):
+    '''  Checks which of flat are in the sorted array sorted_flat
+
+    Input:
+        sorted_flat - sorted array of flat indices
+        flat - the flat indices to look up
+
+    Output:
+        A boolean array with the shape of flat
+    '''
+    if len(sorted_flat) == 0:
+        return np.zeros(np.shape(flat), dtype = bool)
+    positions = np.searchsorted(sorted_flat, flat)
+    np.minimum(positions, len(sorted_flat) - 1, out = positions)
+    return sorted_flat[positions] == flat
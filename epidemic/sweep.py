@@ -0,0 +1,140 @@
+import os
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from epidemic.ensemble import _run_replicate_
+from epidemic.cache import result_cache, _run_key_
+#  The parameters that are swept as floats (the epidemic inputs check for np.float64)
+_FLOAT_PARAMS_ = ('d', 'prob_recover', 'prob_local_infect', 'prob_long_dist_infect')
+#
+#  Parameter sweeps of the epidemic model
+#
+def run_sweep(grid = None, n_replicates = None, n_steps = None, seed = None,
+    max_workers = None, cache_dir = None, as_frame = None, **model_kwargs):
+    """  Runs replicates of the epidemic model over a grid of parameter points
+
+    Inputs -
+        grid - A dictionary of parameter name -> list of values, swept as a
+            cartesian product, or a list of dictionaries (one per point)
+        n_replicates - The number of replicates of every point
+        n_steps - The number of time steps of every replicate
+        seed - The seed of the sweep (an int, or None for fresh entropy)
+            NOTE:  Replicate r of every point uses the child SeedSequence(seed,
+            spawn_key = (r,)), the same as replicate r of run_ensemble, so the
+            points share common random numbers and adding points or replicates
+            does not change the existing ones
+        max_workers - The number of worker processes (default: one per core)
+            NOTE:  max_workers = 1 runs the tasks in this process
+        cache_dir - If not None, a result_cache directory; every (point, replicate)
+            is stored under a key of its full parameters, seed, n_steps and the
+            code version, so a rerun or an extended grid only computes the
+            missing tasks
+            NOTE:  Without a seed the results can never be reused, so nothing is cached
+        as_frame - If True return a pandas.DataFrame instead of a dictionary
+        model_kwargs - The epidemic constructor arguments shared by every point
+            NOTE:  memmap_path is not allowed, the replicates keep their lattices in memory
+
+    Outputs -
+        A columnar table (dictionary of equal length numpy arrays) with one row
+        per (point, replicate):
+            point, replicate - the point and replicate numbers
+            one column per swept parameter
+            pop_size - the population size
+            final_size - the number of people ever infected
+            peak_infected, peak_time - the largest number infected and its step
+            extinction_time - the first step with no one infected (-1 if none)
+            cached - True for the rows read from the cache
+    """
+    assert grid is not None
+    assert n_replicates is not None
+    assert n_replicates >= 1
+    assert n_steps is not None
+    assert n_steps >= 0
+    #  Every replicate would open the same memmap file in 'w+' mode
+    assert 'memmap_path' not in model_kwargs
+    points = _grid_points_(grid)
+    names = sorted(set(itertools.chain.from_iterable(points)))
+    entropy = np.random.SeedSequence(seed).entropy
+    cache = None if cache_dir is None or seed is None else result_cache(cache_dir)
+    #  The table is filled in place as the results arrive
+    num_rows = len(points) * n_replicates
+    table = {
+        'point': np.repeat(np.arange(len(points)), n_replicates),
+        'replicate': np.tile(np.arange(n_replicates), len(points)),
+    }
+    for name in names:
+        table[name] = np.repeat(np.array([p.get(name) for p in points]), n_replicates)
+    for column in ('pop_size', 'final_size', 'peak_infected', 'peak_time', 'extinction_time'):
+        table[column] = np.empty(num_rows, dtype = np.int64)
+    table['cached'] = np.zeros(num_rows, dtype = bool)
+    #  Read the cached rows and gather the missing tasks
+    tasks = {}
+    for row in range(num_rows):
+        params = dict(model_kwargs)
+        params.update(points[row // n_replicates])
+        params = _model_params_(params)
+        replicate = row % n_replicates
+        key = None
+        if cache is not None:
+            key = cache.key(params = _run_key_(params), entropy = entropy, replicate = replicate, n_steps = n_steps)
+            arrays = cache.get(key)
+            if arrays is not None:
+                _fill_row_(table, row, arrays['counts'])
+                table['cached'][row] = True
+                continue
+        tasks[row] = ((np.random.SeedSequence(entropy, spawn_key = (replicate,)), n_steps, params), key)
+    #  Run the missing tasks, caching each result as soon as it arrives
+    if max_workers == 1:
+        for row, (task, key) in tasks.items():
+            _store_row_(table, row, _run_replicate_(task), cache, key)
+    elif len(tasks) > 0:
+        num_workers = os.cpu_count() if max_workers is None else max_workers
+        with ProcessPoolExecutor(max_workers = num_workers) as executor:
+            futures = dict([(executor.submit(_run_replicate_, task), (row, key))
+                for row, (task, key) in tasks.items()])
+            for future in as_completed(futures):
+                row, key = futures[future]
+                _store_row_(table, row, future.result(), cache, key)
+    if as_frame:
+        import pandas as pd
+        return pd.DataFrame(table)
+    return table
+#
+#  The points of a grid
+#
+def _grid_points_(grid = None):
+    '''  Expands a dictionary of value lists into the list of its points
+    '''
+    if isinstance(grid, dict):
+        names = list(grid.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[grid[n] for n in names])]
+    return [dict(p) for p in grid]
+def _model_params_(params = None):
+    '''  Converts the parameters to the types the epidemic inputs expect
+    '''
+    params = dict(params)
+    for name in _FLOAT_PARAMS_:
+        if params.get(name) is not None:
+            params[name] = np.float64(params[name])
+    for name in ('dim', 'target_size', 'I_0'):
+        if params.get(name) is not None:
+            params[name] = int(params[name])
+    return params
+#
+#  Summaries of a replicate
+#
+def _store_row_(table = None, row = None, counts = None, cache = None, key = None):
+    if cache is not None:
+        cache.put(key, {'counts': counts})
+    _fill_row_(table, row, counts)
+def _fill_row_(table = None, row = None, counts = None):
+    '''  Writes the summary of the (3, n_steps + 1) counts of a replicate to a row
+    '''
+    pop_size = int(counts[:, 0].sum())
+    infected = counts[1]
+    extinct = np.flatnonzero(infected == 0)
+    table['pop_size'][row] = pop_size
+    table['final_size'][row] = pop_size - int(counts[0, -1])
+    table['peak_infected'][row] = int(infected.max())
+    table['peak_time'][row] = int(np.argmax(infected))
+    table['extinction_time'][row] = extinct[0] if len(extinct) > 0 else -1
@@ -0,0 +1,79 @@
+import importlib.util
+import numpy as np
+#
+#  Optional PyTorch (CPU) backend for the epidemic step
+#  NOTE:  torch is only imported when the backend is used, so importing epidemic
+#  stays cheap; HAVE_TORCH tells epidemic if the backend can be used
+#
+HAVE_TORCH = importlib.util.find_spec('torch') is not None
+
+def _torch_stencil_(coord_array = None, reach = None):
+    '''  Builds the conv2d weight that counts the infected friends of a person
+
+    Input:
+        coord_array - (K, 2) stencil offsets
+        reach - the largest absolute offset
+
+    Output:
+        A (1, 1, 2 reach + 1, 2 reach + 1) float32 tensor of ones on the stencil
+        NOTE:  The origin is left out since a person is not their own friend
+    '''
+    import torch
+    weight = np.zeros((2 * reach + 1, 2 * reach + 1), dtype = np.float32)
+    weight[coord_array[:, 0] + reach, coord_array[:, 1] + reach] = 1.0
+    weight[reach, reach] = 0.0
+    return torch.from_numpy(weight)[None, None]
+
+def _torch_generator_(seed_seq = None):
+    '''  Builds a torch.Generator seeded from the SeedSequence of the model
+    '''
+    import torch
+    generator = torch.Generator()
+    generator.manual_seed(int(seed_seq.generate_state(1, dtype = np.uint64)[0] >> np.uint64(1)))
+    return generator
+
+def _torch_step_(people_state = None, infected_flat = None, stencil = None, reach = None,
+    prob_recover = None, prob_local_infect = None, prob_long_dist_infect = None,
+    S = None, I = None, generator = None):
+    '''  Draws the transitions of a step with torch kernels
+
+    Input:
+        people_state - the (edge, edge) lattice; torch shares its memory, nothing is copied
+        infected_flat - the sorted flat indices of the infected people
+        stencil - the conv2d weight from _torch_stencil_
+        reach - the largest absolute stencil offset
+        prob_recover, prob_local_infect, prob_long_dist_infect - the probabilities
+        S, I - the susceptible and infected states
+        generator - the torch.Generator of the model
+
+    Output:
+        new_infected - sorted unique flat indices of the newly infected people
+        recovered_mask - boolean mask over infected_flat of the recovered people
+        NOTE:  The infected friends are counted by a conv2d of the lattice wrapped
+        by reach on every side, and a susceptible person with k infected friends
+        is infected with probability 1-(1-prob_local_infect)^k, the same law as
+        the numpy kernels.
+        The lattice is not written here.  torch runs the conv2d and the random
+        fills on its intra-op thread pool.
+    '''
+    import torch
+    import torch.nn.functional as F
+    lattice = torch.from_numpy(people_state)
+    pop_size = lattice.numel()
+    num_infected = len(infected_flat)
+    recovered_mask = (torch.rand(num_infected, generator = generator) < prob_recover).numpy()
+    #  Count the infected friends of every person
+    #  NOTE:  The wrap is an index, not a circular pad, since reach can be larger than the edge
+    wrapped = torch.from_numpy(np.mod(np.arange(-reach, lattice.shape[0] + reach), lattice.shape[0]))
+    infected = (lattice == int(I)).to(torch.float32)
+    padded = infected.index_select(0, wrapped).index_select(1, wrapped)[None, None]
+    counts = F.conv2d(padded, stencil)[0, 0]
+    candidates = torch.nonzero(((counts > 0) & (lattice == int(S))).reshape(-1)).reshape(-1)
+    prob_infect = 1.0 - (1.0 - prob_local_infect) ** counts.reshape(-1)[candidates]
+    local = candidates[torch.rand(len(candidates), generator = generator, dtype = torch.float64) < prob_infect]
+    #  Long distance targets are only drawn for the infected people who try
+    num_chosen = int((torch.rand(num_infected, generator = generator) < prob_long_dist_infect).sum())
+    targets = torch.randint(pop_size, (num_chosen,), generator = generator)
+    targets = targets[lattice.reshape(-1)[targets] == int(S)]
+    new_infected = torch.unique(torch.cat((local, targets))).numpy()
+    return new_infected, recovered_mask
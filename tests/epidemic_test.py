@@ -0,0 +1,823 @@
+import os
+import sys
+import subprocess
+import tempfile
+import unittest
+import numpy as np
+from pprint import pprint
+
+from epidemic.epidemic_class import epidemic, _coordinate_list_
+from epidemic.ensemble import run_ensemble
+from epidemic.sweep import run_sweep
+from epidemic.cache import cached_run, result_cache
+from epidemic.batched import batched_epidemic
+from epidemic.sparse import sparse_epidemic
+from epidemic.numba_kernel import HAVE_NUMBA
+from epidemic.torch_kernel import HAVE_TORCH
+from epidemic.recorder import trajectory_recorder, trajectory_replayer
+from epidemic.render import frame_renderer
+from epidemic.ring_buffer import ring_buffer
+from epidemic.sampling import bernoulli_indices, bernoulli_count, MAX_BATCH
+
+def build_model(**kwargs):
+    params = dict(dim = 2, d = np.float64(2.0), target_size = 400, I_0 = 5,
+        prob_recover = np.float64(0.2), prob_local_infect = np.float64(0.3),
+        prob_long_dist_infect = np.float64(0.05), seed = 42)
+    params.update(kwargs)
+    return epidemic(**params)
+
+class EpidemicStateTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicStateTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicStateTest')
+
+    def test_compact_lattice(self):
+        model = build_model()
+        lattice = model.get_people_state()
+        self.assertEqual(lattice.dtype, np.uint8)
+        self.assertEqual(lattice.shape, (20, 20))
+        self.assertEqual(model.get_population_size(), 400)
+        for _ in range(10):
+            model.single_time_step()
+        self.assertEqual(model.get_people_state().dtype, np.uint8)
+        self.assertEqual(sum(model.get_people_states()), model.get_population_size())
+
+    def test_legacy_dtype(self):
+        model = build_model(state_dtype = np.int64)
+        self.assertEqual(model.get_people_state().dtype, np.int64)
+        model.single_time_step()
+        self.assertEqual(sum(model.get_people_states()), model.get_population_size())
+
+class EpidemicCountTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicCountTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicCountTest')
+
+    def test_running_counts(self):
+        model = build_model(I_0 = 20, prob_long_dist_infect = np.float64(0.5))
+        self.assertEqual(model.get_people_states(), model._count_people_states_())
+        for _ in range(25):
+            model.single_time_step()
+            self.assertEqual(model.get_people_states(), model._count_people_states_())
+
+    def test_infected_index(self):
+        model = build_model(I_0 = 20)
+        for _ in range(25):
+            model.single_time_step()
+            infected = np.flatnonzero(model.get_people_state() == model.I)
+            self.assertTrue(np.array_equal(model.get_infected_indices(), infected))
+
+class EpidemicKernelTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicKernelTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicKernelTest')
+
+    def test_certain_local_infection(self):
+        #  With certain local infection the infected set grows by the stencil each step
+        model = build_model(I_0 = 1, prob_recover = np.float64(0.0),
+            prob_local_infect = np.float64(1.0), prob_long_dist_infect = np.float64(0.0))
+        edge = model.get_edge_size()
+        start = np.unravel_index(model.get_infected_indices()[0], (edge, edge))
+        expected = np.zeros((edge, edge), dtype = bool)
+        for c in model.get_coordinate_list():
+            expected[(start[0] + c[0]) % edge, (start[1] + c[1]) % edge] = True
+        model.single_time_step()
+        self.assertTrue(np.array_equal(model.get_people_state() == model.I, expected))
+        self.assertEqual(model.get_number_infected(), len(model.get_coordinate_list()))
+
+    def test_neighbor_indices(self):
+        model = build_model(d = np.float64(3.0))
+        edge = model.get_edge_size()
+        coords = np.array([[0, 0], [edge - 1, 5], [2, edge - 2], [10, 9], [3, 16]])
+        flat = np.ravel_multi_index(tuple(coords.T), (edge, edge))
+        for k, c in enumerate(model.get_coordinate_list()):
+            offset = np.full(len(flat), k)
+            expected = np.ravel_multi_index(tuple(((coords + c) % edge).T), (edge, edge))
+            self.assertTrue(np.array_equal(model._neighbor_indices_(flat, offset), expected))
+
+    def test_stencil(self):
+        for dim, dist in ((1, 2.5), (2, 1.0), (2, 2.0 ** 0.5), (3, 2.0), (2, 12.0), (4, 3.0)):
+            coords = _coordinate_list_(dim, np.float64(dist))
+            n_dist = int(dist)
+            expected = [c for c in np.ndindex(*([2 * n_dist + 1] * dim))
+                if np.linalg.norm(np.array(c) - n_dist) <= dist]
+            self.assertTrue(np.array_equal(coords, np.array(expected) - n_dist))
+            self.assertFalse(coords.flags.writeable)
+            self.assertIs(_coordinate_list_(dim, np.float64(dist)), coords)
+
+class EpidemicRunTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicRunTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicRunTest')
+
+    def test_run_records(self):
+        model = build_model()
+        times, s, i, r = model.run(10, record_every = 3)
+        self.assertTrue(np.array_equal(times, [0, 3, 6, 9, 10]))
+        self.assertTrue(np.all(s + i + r == model.get_population_size()))
+        self.assertEqual((s[-1], i[-1], r[-1]), model.get_people_states())
+
+    def test_run_stops_early(self):
+        model = build_model(prob_recover = np.float64(1.0), prob_local_infect = np.float64(0.0),
+            prob_long_dist_infect = np.float64(0.0))
+        times, s, i, r = model.run(50)
+        self.assertTrue(np.array_equal(times, [0, 1]))
+        self.assertEqual(i[-1], 0)
+        self.assertEqual(model.current_time, 1)
+        #  A second run of the extinct model only records its state
+        times, s, i, r = model.run(5)
+        self.assertTrue(np.array_equal(times, [1]))
+        self.assertEqual(len(s), 1)
+
+    def test_run_without_infected(self):
+        model = build_model(I_0 = 0)
+        times, s, i, r = model.run(5)
+        self.assertTrue(np.array_equal(times, [0]))
+        self.assertTrue(np.array_equal(s, [model.get_population_size()]))
+        batch = batched_epidemic(replicates = 2, d = np.float64(2.0), target_size = 400, I_0 = 0,
+            prob_recover = np.float64(0.2), prob_local_infect = np.float64(0.3),
+            prob_long_dist_infect = np.float64(0.05), seed = 1)
+        times, s, i, r = batch.run(5)
+        self.assertTrue(np.array_equal(times, [0]))
+        self.assertEqual(s.shape, (2, 1))
+
+class EpidemicRandomTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicRandomTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicRandomTest')
+
+    def test_seeded_models_are_independent(self):
+        model_a = build_model(seed = 7)
+        series_a = model_a.run(15)
+        #  Interleave two models and the global generator; the results must not change
+        model_b = build_model(seed = 7)
+        model_c = build_model(seed = 8)
+        for _ in range(15):
+            np.random.uniform(size = 10)
+            model_b.single_time_step()
+            model_c.single_time_step()
+        self.assertTrue(np.array_equal(model_a.get_people_state(), model_b.get_people_state()))
+        self.assertEqual(series_a[2][-1], model_b.get_number_infected())
+
+    def test_seed_sequence(self):
+        children = np.random.SeedSequence(3).spawn(2)
+        model_a = build_model(seed = children[0], bit_generator = np.random.Philox)
+        model_b = build_model(seed = np.random.SeedSequence(3).spawn(2)[0], bit_generator = np.random.Philox)
+        model_a.run(10)
+        model_b.run(10)
+        self.assertTrue(np.array_equal(model_a.get_people_state(), model_b.get_people_state()))
+
+class EpidemicSamplingTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicSamplingTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicSamplingTest')
+
+    def test_bernoulli_indices(self):
+        rng = np.random.default_rng(5)
+        for n_trials, prob in ((0, 0.1), (100, 0.0), (100, 1.0), (1000, 0.5), (10**7, 0.2), (10**6, 0.01)):
+            indices = bernoulli_indices(rng, n_trials, prob)
+            self.assertTrue(np.all(np.diff(indices) > 0))
+            if len(indices) > 0:
+                self.assertTrue(0 <= indices[0] and indices[-1] < n_trials)
+            expected = n_trials * prob
+            self.assertLessEqual(abs(len(indices) - expected), 5.0 * np.sqrt(expected * (1.0 - prob)) + 1e-9)
+        #  More successes than one batch
+        self.assertGreater(len(bernoulli_indices(rng, 10**7, 0.2)), MAX_BATCH)
+
+    def test_uniform_positions(self):
+        rng = np.random.default_rng(6)
+        hits = np.zeros(50)
+        for _ in range(2000):
+            hits[bernoulli_indices(rng, 50, 0.1)] += 1
+        self.assertLess(np.max(np.abs(hits - 200.0)), 5.0 * np.sqrt(180.0))
+        counts = [bernoulli_count(rng, 1000, 0.3) for _ in range(200)]
+        self.assertLess(abs(np.mean(counts) - 300.0), 5.0)
+
+class EpidemicEnsembleTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicEnsembleTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicEnsembleTest')
+
+    def test_ensemble(self):
+        params = dict(dim = 2, d = np.float64(1.5), target_size = 400, I_0 = 3,
+            prob_recover = np.float64(0.3), prob_local_infect = np.float64(0.2),
+            prob_long_dist_infect = np.float64(0.01))
+        serial = run_ensemble(6, 20, seed = 11, max_workers = 1, **params)
+        pooled = run_ensemble(6, 20, seed = 11, max_workers = 2, **params)
+        self.assertEqual(serial['infected'].shape, (6, 21))
+        self.assertTrue(np.array_equal(serial['infected'], pooled['infected']))
+        totals = serial['susceptible'] + serial['infected'] + serial['recovered']
+        self.assertTrue(np.all(totals == 400))
+        self.assertEqual(serial['quantile_values'].shape, (3, 3, 21))
+        self.assertTrue(np.array_equal(serial['final_size'], 400 - serial['susceptible'][:, -1]))
+        #  The replicates cannot share one memmap file
+        with self.assertRaises(AssertionError):
+            run_ensemble(2, 5, seed = 11, max_workers = 1, memmap_path = 'lattice.dat', **params)
+        with self.assertRaises(AssertionError):
+            run_sweep({'I_0': [3]}, n_replicates = 2, n_steps = 5, max_workers = 1,
+                memmap_path = 'lattice.dat', **dict([(k, v) for k, v in params.items() if k != 'I_0']))
+
+class EpidemicSweepTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicSweepTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicSweepTest')
+
+    def sweep_kwargs(self):
+        return dict(n_replicates = 3, n_steps = 15, seed = 11, d = 2.0, target_size = 400, I_0 = 5,
+            prob_recover = 0.2, prob_long_dist_infect = 0.05)
+
+    def test_sweep_matches_ensemble(self):
+        table = run_sweep({'prob_local_infect': [0.1, 0.3]}, max_workers = 1, **self.sweep_kwargs())
+        self.assertEqual(len(table['point']), 6)
+        ensemble = run_ensemble(n_replicates = 3, n_steps = 15, seed = 11, max_workers = 1,
+            d = np.float64(2.0), target_size = 400, I_0 = 5, prob_recover = np.float64(0.2),
+            prob_local_infect = np.float64(0.3), prob_long_dist_infect = np.float64(0.05))
+        rows = table['point'] == 1
+        self.assertTrue(np.all(table['prob_local_infect'][rows] == 0.3))
+        self.assertTrue(np.array_equal(table['final_size'][rows], ensemble['final_size']))
+        self.assertTrue(np.array_equal(table['peak_infected'][rows], ensemble['infected'].max(axis = 1)))
+
+    def test_sweep_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            first = run_sweep({'prob_local_infect': [0.1, 0.3]}, max_workers = 2, cache_dir = tmp_dir,
+                **self.sweep_kwargs())
+            self.assertFalse(np.any(first['cached']))
+            #  Extending the grid only runs the new point
+            second = run_sweep({'prob_local_infect': [0.1, 0.3, 0.5]}, max_workers = 1, cache_dir = tmp_dir,
+                **self.sweep_kwargs())
+            self.assertTrue(np.array_equal(second['cached'], np.arange(9) < 6))
+            for column in ('final_size', 'peak_infected', 'peak_time', 'extinction_time'):
+                self.assertTrue(np.array_equal(first[column], second[column][:6]))
+            #  Class and dtype arguments are keyed like cached_run keys them
+            kwargs = dict(self.sweep_kwargs(), bit_generator = np.random.Philox, state_dtype = np.uint16)
+            third = run_sweep({'prob_local_infect': [0.3]}, max_workers = 1, cache_dir = tmp_dir, **kwargs)
+            fourth = run_sweep({'prob_local_infect': [0.3]}, max_workers = 1, cache_dir = tmp_dir, **kwargs)
+            self.assertFalse(np.any(third['cached']))
+            self.assertTrue(np.all(fourth['cached']))
+            #  A run without a seed is not cached
+            size = result_cache(tmp_dir).size()
+            kwargs['seed'] = None
+            run_sweep({'prob_local_infect': [0.3]}, max_workers = 1, cache_dir = tmp_dir, **kwargs)
+            self.assertEqual(result_cache(tmp_dir).size(), size)
+
+class EpidemicCacheTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicCacheTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicCacheTest')
+
+    def test_cached_run(self):
+        kwargs = dict(dim = 2, d = np.float64(2.0), target_size = 400, I_0 = 5,
+            prob_recover = np.float64(0.2), prob_local_infect = np.float64(0.3),
+            prob_long_dist_infect = np.float64(0.05), seed = 42)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            first = cached_run(20, tmp_dir, **kwargs)
+            second = cached_run(20, tmp_dir, **kwargs)
+            self.assertFalse(first.cached)
+            self.assertTrue(second.cached)
+            for a, b in zip(first[:5], second[:5]):
+                self.assertTrue(np.array_equal(a, b))
+            model = build_model()
+            model.run(20)
+            self.assertTrue(np.array_equal(second.people_state, model.get_people_state()))
+            self.assertFalse(cached_run(21, tmp_dir, **kwargs).cached)
+            kwargs['seed'] = None
+            self.assertFalse(cached_run(20, tmp_dir, **kwargs).cached)
+
+    def test_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = result_cache(tmp_dir, max_bytes = 3000)
+            keys = [cache.key(n = n) for n in range(3)]
+            cache.put(keys[0], {'a': np.zeros(100)})
+            cache.put(keys[1], {'a': np.zeros(100)})
+            os.utime(cache._file_(keys[0]), ns = (1, 1))
+            os.utime(cache._file_(keys[1]), ns = (2, 2))
+            self.assertIsNotNone(cache.get(keys[0]))  # now the most recently used
+            cache.put(keys[2], {'a': np.zeros(100)})
+            self.assertTrue(cache.contains(keys[0]))
+            self.assertFalse(cache.contains(keys[1]))
+            self.assertTrue(cache.contains(keys[2]))
+            self.assertLessEqual(cache.size(), 3000)
+
+class EpidemicBatchedTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicBatchedTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicBatchedTest')
+
+    def test_batched_counts(self):
+        model = batched_epidemic(replicates = 8, d = np.float64(2.0), target_size = 400, I_0 = 3,
+            prob_recover = np.float64(0.2), prob_local_infect = np.float64(0.2),
+            prob_long_dist_infect = np.float64(0.05), seed = 5)
+        self.assertEqual(model.get_people_state().shape, (8, 20, 20))
+        times, s, i, r = model.run(20)
+        self.assertEqual(i.shape[0], 8)
+        lattice = model.get_people_state()
+        for k, state in enumerate((model.S, model.I, model.R)):
+            counts = np.count_nonzero(lattice == state, axis = (1, 2))
+            self.assertTrue(np.array_equal(counts, (s, i, r)[k][:, -1]))
+        self.assertTrue(np.array_equal(model.infected_flat, np.flatnonzero(lattice == model.I)))
+        #  The replicates must not all follow the same path
+        self.assertGreater(len(np.unique(i[:, -1])), 1)
+
+    def test_batched_certain_infection(self):
+        model = batched_epidemic(replicates = 3, d = np.float64(2.0), target_size = 400, I_0 = 1,
+            prob_recover = np.float64(0.0), prob_local_infect = np.float64(1.0),
+            prob_long_dist_infect = np.float64(0.0), seed = 5)
+        model.single_time_step()
+        self.assertTrue(np.all(model.get_number_infected() == len(model.coord_list)))
+
+    def test_batched_neighbors(self):
+        #  The shared lookup keeps every neighbor in the replicate of the person
+        batch = batched_epidemic(replicates = 3, d = np.float64(2.0), target_size = 400, I_0 = 1,
+            prob_recover = np.float64(0.2), prob_local_infect = np.float64(0.2),
+            prob_long_dist_infect = np.float64(0.0), seed = 5)
+        single = build_model()
+        rng = np.random.default_rng(2)
+        cells = rng.integers(400, size = 200)
+        replicate = rng.integers(3, size = 200)
+        offset = rng.integers(len(single.coord_array), size = 200)
+        expected = single._neighbor_indices_(cells, offset) + replicate * 400
+        self.assertTrue(np.array_equal(batch._neighbor_indices_(cells + replicate * 400, offset), expected))
+
+    def test_batched_kernels_agree(self):
+        #  Certain local infection makes both kernels deterministic
+        models = [batched_epidemic(replicates = 4, d = np.float64(2.0), target_size = 400, I_0 = 2,
+            prob_recover = np.float64(0.0), prob_local_infect = np.float64(1.0),
+            prob_long_dist_infect = np.float64(0.0), seed = 7, density_threshold = threshold)
+            for threshold in (1.0, 0.0)]
+        for _ in range(2):
+            for model in models:
+                model.single_time_step()
+        self.assertEqual([m.infection_mode for m in models], ['list', 'density'])
+        self.assertTrue(np.array_equal(models[0].get_people_state(), models[1].get_people_state()))
+        self.assertTrue(np.array_equal(models[0].get_number_infected(), models[1].get_number_infected()))
+
+class EpidemicSparseTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicSparseTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicSparseTest')
+
+    def test_sparse_matches_dense(self):
+        #  Both use the list kernel so the same seed gives the same path
+        dense = build_model(target_size = 2500, I_0 = 2, seed = 9, density_threshold = 1.0)
+        sparse = sparse_epidemic(dim = 2, d = np.float64(2.0), target_size = 2500, I_0 = 2,
+            prob_recover = np.float64(0.2), prob_local_infect = np.float64(0.3),
+            prob_long_dist_infect = np.float64(0.05), seed = 9, dense_threshold = 0.2,
+            density_threshold = 1.0)
+        self.assertFalse(sparse.is_dense())
+        self.assertIsNone(sparse.people_state)
+        switched = False
+        for _ in range(30):
+            dense.single_time_step()
+            sparse.single_time_step()
+            switched = switched or sparse.is_dense()
+            self.assertEqual(dense.get_people_states(), sparse.get_people_states())
+            self.assertEqual(sparse.get_people_states(), sparse._count_people_states_())
+            self.assertTrue(np.array_equal(dense.get_people_state(), sparse.get_people_state()))
+        self.assertTrue(switched)
+
+    def test_huge_sparse_population(self):
+        model = sparse_epidemic(dim = 2, d = np.float64(2.0), target_size = 10**10, I_0 = 10,
+            prob_recover = np.float64(0.2), prob_local_infect = np.float64(0.3),
+            prob_long_dist_infect = np.float64(0.05), seed = 1)
+        model.run(10)
+        self.assertFalse(model.is_dense())
+        self.assertEqual(sum(model.get_people_states()), 10**10)
+
+    def test_density_kernel(self):
+        #  Certain infection makes both kernels deterministic
+        kwargs = dict(I_0 = 30, prob_recover = np.float64(0.5), prob_local_infect = np.float64(1.0),
+            prob_long_dist_infect = np.float64(0.0))
+        list_model = build_model(density_threshold = 1.0, **kwargs)
+        density_model = build_model(density_threshold = 0.0, **kwargs)
+        list_model.single_time_step()
+        density_model.single_time_step()
+        self.assertEqual(list_model.infection_mode, 'list')
+        self.assertEqual(density_model.infection_mode, 'density')
+        self.assertTrue(np.array_equal(list_model.get_people_state() > 0, density_model.get_people_state() > 0))
+
+    def test_density_counts(self):
+        model = build_model(target_size = 2500, density_threshold = 0.02)
+        modes = set()
+        for _ in range(30):
+            model.single_time_step()
+            modes.add(model.infection_mode)
+            self.assertEqual(model.get_people_states(), model._count_people_states_())
+            self.assertTrue(np.array_equal(model.get_infected_indices(),
+                np.flatnonzero(model.get_people_state() == model.I)))
+        self.assertEqual(modes, set(['list', 'density']))
+
+    def test_densify_on_memory(self):
+        #  Few infected but many recovered: the indices outgrow the uint8 lattice
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'lattice.dat')
+            model = sparse_epidemic(dim = 2, d = np.float64(2.0), target_size = 2500, I_0 = 5,
+                prob_recover = np.float64(0.5), prob_local_infect = np.float64(0.3),
+                prob_long_dist_infect = np.float64(0.05), seed = 4, dense_threshold = 1.0,
+                density_threshold = 1.0, memmap_path = path)
+            while not model.is_dense() and model.get_number_infected() > 0:
+                sparse_bytes = model._sparse_bytes_()
+                model.single_time_step()
+            self.assertTrue(model.is_dense())
+            self.assertLess(sparse_bytes, model.get_population_size())
+            self.assertIsInstance(model.get_people_state(), np.memmap)
+            self.assertEqual(model.get_people_states(), model._count_people_states_())
+            del model
+
+class EpidemicThreadTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicThreadTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicThreadTest')
+
+    def test_threaded_is_reproducible(self):
+        models = [build_model(target_size = 2500, seed = 4, n_threads = 4, density_threshold = 0.1)
+            for _ in range(2)]
+        for model in models:
+            model.run(30)
+            self.assertEqual(model.get_people_states(), model._count_people_states_())
+            self.assertTrue(np.array_equal(model.get_infected_indices(),
+                np.flatnonzero(model.get_people_state() == model.I)))
+            model.close()
+        self.assertTrue(np.array_equal(models[0].get_people_state(), models[1].get_people_state()))
+
+    def test_threaded_shared_seed_sequence(self):
+        #  Building a threaded model must not change the SeedSequence it is given
+        seed_seq = np.random.SeedSequence(3)
+        lattices = []
+        for _ in range(2):
+            model = build_model(target_size = 2500, seed = seed_seq, n_threads = 2)
+            model.run(20)
+            lattices.append(model.get_people_state().copy())
+            model.close()
+        self.assertTrue(np.array_equal(lattices[0], lattices[1]))
+        self.assertEqual(seed_seq.n_children_spawned, 0)
+
+    def test_threaded_certain_infection(self):
+        kwargs = dict(I_0 = 30, prob_recover = np.float64(0.0), prob_local_infect = np.float64(1.0),
+            prob_long_dist_infect = np.float64(0.0))
+        for threshold in (0.0, 1.0):
+            serial = build_model(density_threshold = threshold, **kwargs)
+            threaded = build_model(density_threshold = threshold, n_threads = 3, **kwargs)
+            for _ in range(2):
+                serial.single_time_step()
+                threaded.single_time_step()
+            self.assertTrue(np.array_equal(serial.get_people_state(), threaded.get_people_state()))
+            threaded.close()
+
+@unittest.skipUnless(HAVE_NUMBA, 'Numba is not installed')
+class EpidemicNumbaTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicNumbaTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicNumbaTest')
+
+    def test_numba_matches_numpy(self):
+        for seed in (1, 2, 3):
+            numpy_model = build_model(target_size = 2500, seed = seed, density_threshold = 1.0)
+            numba_model = build_model(target_size = 2500, seed = seed, backend = 'numba')
+            for _ in range(40):
+                numpy_model.single_time_step()
+                numba_model.single_time_step()
+                self.assertEqual(numba_model.infection_mode, 'fused')
+                self.assertEqual(numpy_model.get_people_states(), numba_model.get_people_states())
+            self.assertTrue(np.array_equal(numpy_model.get_people_state(), numba_model.get_people_state()))
+            self.assertTrue(np.array_equal(numpy_model.get_infected_indices(), numba_model.get_infected_indices()))
+
+    def test_numba_is_imported_lazily(self):
+        code = "import sys, epidemic.epidemic_class; sys.exit('numba' in sys.modules)"
+        result = subprocess.run([sys.executable, '-W', 'ignore', '-c', code],
+            cwd = os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 0)
+
+    def test_numba_matches_numpy_skipping(self):
+        #  Small probabilities use geometric skipping in both backends
+        kwargs = dict(target_size = 2500, I_0 = 20, prob_local_infect = np.float64(0.08),
+            prob_long_dist_infect = np.float64(0.02), prob_recover = np.float64(0.1))
+        numpy_model = build_model(density_threshold = 1.0, **kwargs)
+        numba_model = build_model(backend = 'numba', **kwargs)
+        for _ in range(40):
+            numpy_model.single_time_step()
+            numba_model.single_time_step()
+        self.assertTrue(np.array_equal(numpy_model.get_people_state(), numba_model.get_people_state()))
+
+@unittest.skipUnless(HAVE_TORCH, 'PyTorch is not installed')
+class EpidemicTorchTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicTorchTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicTorchTest')
+
+    def test_torch_certain_infection(self):
+        kwargs = dict(I_0 = 30, prob_recover = np.float64(0.5), prob_local_infect = np.float64(1.0),
+            prob_long_dist_infect = np.float64(0.0))
+        numpy_model = build_model(**kwargs)
+        torch_model = build_model(backend = 'torch', **kwargs)
+        numpy_model.single_time_step()
+        torch_model.single_time_step()
+        self.assertEqual(torch_model.infection_mode, 'torch')
+        self.assertTrue(np.array_equal(numpy_model.get_people_state() > 0, torch_model.get_people_state() > 0))
+
+    def test_torch_small_lattice(self):
+        #  The stencil reaches around the 4x4 lattice more than once
+        torch_model = build_model(target_size = 16, d = np.float64(5.0), I_0 = 1, backend = 'torch',
+            prob_local_infect = np.float64(1.0), prob_long_dist_infect = np.float64(0.0),
+            prob_recover = np.float64(0.0))
+        torch_model.single_time_step()
+        self.assertEqual(torch_model.get_number_infected(), 16)
+
+    def test_torch_is_reproducible(self):
+        models = [build_model(target_size = 2500, backend = 'torch', seed = 3) for _ in range(2)]
+        for model in models:
+            model.run(30)
+            self.assertEqual(model.get_people_states(), model._count_people_states_())
+            self.assertTrue(np.array_equal(model.get_infected_indices(),
+                np.flatnonzero(model.get_people_state() == model.I)))
+        self.assertTrue(np.array_equal(models[0].get_people_state(), models[1].get_people_state()))
+
+class EpidemicCheckpointTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicCheckpointTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicCheckpointTest')
+
+    def _check_resume_(self, builder):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model = builder(tmp_dir)
+            model.run(10)
+            model.checkpoint(os.path.join(tmp_dir, 'checkpoint'))
+            model.run(15)
+            resumed = builder(tmp_dir)
+            resumed.restore(os.path.join(tmp_dir, 'checkpoint'))
+            self.assertEqual(resumed.current_time, 10)
+            resumed.run(15)
+            self.assertEqual(model.get_people_states(), resumed.get_people_states())
+            self.assertTrue(np.array_equal(model.get_people_state(), resumed.get_people_state()))
+            self.assertTrue(np.array_equal(model.get_infected_indices(), resumed.get_infected_indices()))
+            model.close()
+            resumed.close()
+
+    def test_resume(self):
+        self._check_resume_(lambda tmp_dir: build_model(target_size = 2500, density_threshold = 0.03))
+
+    def test_resume_memmap_threaded(self):
+        self._check_resume_(lambda tmp_dir: build_model(target_size = 2500, n_threads = 3,
+            bit_generator = np.random.Philox, memmap_path = os.path.join(tmp_dir, 'lattice.dat')))
+
+    def test_resume_sparse(self):
+        self._check_resume_(lambda tmp_dir: sparse_epidemic(dim = 2, d = np.float64(2.0),
+            target_size = 2500, I_0 = 2, prob_recover = np.float64(0.2),
+            prob_local_infect = np.float64(0.3), prob_long_dist_infect = np.float64(0.05),
+            seed = 9, dense_threshold = 0.05))
+
+    @unittest.skipUnless(HAVE_NUMBA, 'Numba is not installed')
+    def test_resume_numba(self):
+        self._check_resume_(lambda tmp_dir: build_model(target_size = 2500, backend = 'numba'))
+
+    @unittest.skipUnless(HAVE_TORCH, 'PyTorch is not installed')
+    def test_resume_torch(self):
+        self._check_resume_(lambda tmp_dir: build_model(target_size = 2500, backend = 'torch'))
+
+class EpidemicBlockTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicBlockTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicBlockTest')
+
+    def block_sums(self, lattice, block_size, state):
+        n_blocks = -(-lattice.shape[0] // block_size)
+        sums = np.zeros((n_blocks, n_blocks), dtype = np.int64)
+        for i in range(n_blocks):
+            for j in range(n_blocks):
+                block = lattice[i * block_size:(i + 1) * block_size, j * block_size:(j + 1) * block_size]
+                sums[i, j] = np.count_nonzero(block == state)
+        return sums
+
+    def test_block_counts(self):
+        for model in (build_model(target_size = 2500, block_size = 7),
+            build_model(target_size = 2500, block_size = 10, n_threads = 3),
+            sparse_epidemic(dim = 2, d = np.float64(2.0), target_size = 2500, I_0 = 5,
+                prob_recover = np.float64(0.2), prob_local_infect = np.float64(0.3),
+                prob_long_dist_infect = np.float64(0.05), seed = 42, block_size = 9)):
+            for _ in range(15):
+                model.single_time_step()
+                counts = model.get_block_counts()
+                lattice = model.get_people_state()
+                for state in range(3):
+                    self.assertTrue(np.array_equal(counts[state], self.block_sums(lattice, model.get_block_size(), state)))
+            self.assertTrue(np.allclose(model.get_prevalence_map(),
+                counts[1] / self.block_sums(np.zeros_like(lattice), model.get_block_size(), 0)))
+
+    def test_block_checkpoint(self):
+        model = build_model(block_size = 6)
+        for _ in range(4):
+            model.single_time_step()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model.checkpoint(tmp_dir)
+            expected = model.get_block_counts().copy()
+            for _ in range(4):
+                model.single_time_step()
+            model.restore(tmp_dir)
+        self.assertTrue(np.array_equal(model.get_block_counts(), expected))
+
+class EpidemicRecorderTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicRecorderTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicRecorderTest')
+
+    def test_record_and_replay(self):
+        model = build_model(target_size = 2500)
+        recorder = trajectory_recorder(model, keyframe_every = 7, chunk_size = 50)
+        snapshots = [model.get_people_state().copy()]
+        for _ in range(30):
+            model.single_time_step()
+            recorder.record()
+            recorder.record()  # a second call for the same step records nothing
+            snapshots.append(model.get_people_state().copy())
+        self.assertEqual(recorder.get_number_of_steps(), 30)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'run.npz')
+            recorder.save(path)
+            for replayer in (recorder.replayer(), trajectory_replayer(path)):
+                self.assertEqual(len(replayer.get_times()), 31)
+                lattice = None
+                for t in (0, 6, 7, 8, 29, 30, 3):
+                    lattice = replayer.lattice_at(t, out = lattice)
+                    self.assertTrue(np.array_equal(lattice, snapshots[t]))
+
+class EpidemicIterTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicIterTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicIterTest')
+
+    def test_iter_steps(self):
+        model = build_model()
+        lattice = model.get_people_state().copy()
+        count = 0
+        for record in model.iter_steps(12):
+            count += 1
+            self.assertEqual(record.time, count)
+            self.assertIs(record.people_state, model.get_people_state())
+            self.assertEqual((record.susceptible, record.infected, record.recovered), model._count_people_states_())
+            lattice.reshape(-1)[record.new_infected] = model.I
+            lattice.reshape(-1)[record.new_recovered] = model.R
+            self.assertTrue(np.array_equal(lattice, record.people_state))
+        self.assertEqual(count, 12)
+
+    def test_iter_steps_until_done(self):
+        model = build_model(prob_recover = np.float64(0.5), prob_local_infect = np.float64(0.0),
+            prob_long_dist_infect = np.float64(0.0))
+        records = list(model.iter_steps())
+        self.assertEqual(records[-1].infected, 0)
+
+    def test_iter_steps_sparse(self):
+        #  The records have no lattice until the sparse model switches to the dense one
+        model = sparse_epidemic(dim = 2, d = np.float64(2.0), target_size = 2500, I_0 = 5,
+            prob_recover = np.float64(0.1), prob_local_infect = np.float64(0.3),
+            prob_long_dist_infect = np.float64(0.05), seed = 4, dense_threshold = 0.05)
+        lattice = model.get_people_state()
+        sparse_records = 0
+        for record in model.iter_steps(40):
+            if record.people_state is None:
+                self.assertFalse(model.is_dense())
+                sparse_records += 1
+            else:
+                self.assertIs(record.people_state, model.get_people_state())
+            lattice.reshape(-1)[record.new_infected] = model.I
+            lattice.reshape(-1)[record.new_recovered] = model.R
+            self.assertTrue(np.array_equal(lattice, model.get_people_state()))
+        self.assertGreater(sparse_records, 0)
+        self.assertTrue(model.is_dense())
+
+class EpidemicRenderTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicRenderTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicRenderTest')
+
+    def test_palette_lookup(self):
+        model = build_model()
+        for _ in range(5):
+            model.single_time_step()
+        renderer = frame_renderer(model.get_edge_size())
+        frame = renderer.render(model.get_people_state())
+        self.assertEqual(frame.shape, (20, 20, 3))
+        self.assertTrue(np.array_equal(frame, renderer.palette[model.get_people_state()]))
+
+    def test_block_downsample(self):
+        lattice = np.zeros((5, 5), dtype = np.uint8)
+        lattice[0:2, 0:2] = [[1, 1], [1, 2]]
+        lattice[2:4, 2:4] = [[2, 2], [0, 1]]
+        renderer = frame_renderer(5, 3)
+        self.assertEqual(renderer.get_frame_size(), 2)
+        self.assertTrue(np.array_equal(renderer.render_index(lattice), [[1, 0], [0, 2]]))
+        #  The frame is never larger than the target
+        self.assertEqual(frame_renderer(1000, 512).get_frame_size(), 500)
+        mixer = frame_renderer(5, 3, mode = 'fraction', palette = [[0, 0, 0], [200, 0, 0], [0, 0, 200]])
+        frame = mixer.render(lattice)
+        self.assertTrue(np.array_equal(frame[0, 0], [150, 0, 50]))
+        self.assertTrue(np.array_equal(frame[0, 1], [0, 0, 0]))
+
+    def test_png(self):
+        model = build_model()
+        renderer = frame_renderer(model.get_edge_size(), 10)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'frame.png')
+            renderer.write_png(path, renderer.render(model.get_people_state()))
+            with open(path, 'rb') as f:
+                data = f.read()
+        self.assertTrue(data.startswith(b'\x89PNG\r\n\x1a\n'))
+        self.assertEqual(data[12:16], b'IHDR')
+
+class EpidemicProfileTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicProfileTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicProfileTest')
+
+    def test_ring_buffer(self):
+        buffer = ring_buffer(np.dtype([('time', np.int64), ('value', np.float64)]), 4)
+        for t in range(6):
+            buffer.append((t, 0.5 * t))
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(buffer.get_total(), 6)
+        self.assertTrue(np.array_equal(buffer.records()['time'], [2, 3, 4, 5]))
+        self.assertEqual(buffer.last()['value'], 2.5)
+        other = ring_buffer(buffer.buffer.dtype, 3)
+        other.set_state(*buffer.get_state())
+        self.assertTrue(np.array_equal(other.records()['time'], [3, 4, 5]))
+        self.assertEqual(other.get_total(), 6)
+
+    def test_profile(self):
+        model = build_model(target_size = 2500)
+        plain = build_model(target_size = 2500)
+        model.enable_profiling(capacity = 8, trace_memory = True)
+        for _ in range(10):
+            model.single_time_step()
+            plain.single_time_step()
+        #  Profiling does not change the path of the model
+        self.assertTrue(np.array_equal(model.get_people_state(), plain.get_people_state()))
+        records = model.get_profile()
+        self.assertEqual(len(records), 8)
+        self.assertTrue(np.array_equal(records['time'], np.arange(2, 10)))
+        self.assertTrue(np.all(records['local'] > 0.0))
+        self.assertTrue(np.all(records['alloc_bytes'] > 0))
+        summary = model.get_profile_summary()
+        self.assertEqual(summary['steps'], 8)
+        self.assertAlmostEqual(sum([p['total'] for p in summary['phases'].values()]), summary['total'])
+        model.close()
+        self.assertIsNone(model.profiler)
+
+class EpidemicStatusTest(unittest.TestCase):
+
+    def __init__(self,*args,**kwargs):
+        super(EpidemicStatusTest,self).__init__(*args, **kwargs)
+        pprint('EpidemicStatusTest')
+
+    def test_bounded_log(self):
+        model = build_model(status_capacity = 16, prob_local_infect = np.float64(0.0),
+            prob_long_dist_infect = np.float64(0.0), prob_recover = np.float64(0.5))
+        counts = []
+        times = []
+        for _ in range(40):
+            counts.append(model.get_people_states())
+            times.append(model.current_time)  # the time stops once no one is infected
+            model.single_time_step()
+        log = model.get_exec_log()
+        self.assertEqual(len(log), 16)
+        self.assertTrue(np.array_equal(log['time'], times[-16:]))
+        self.assertEqual(tuple(log[-1][['susceptible', 'infected', 'recovered']].tolist()), counts[-1])
+        status = model.get_exec_status()
+        self.assertEqual(status[0], "Current Time: {}\n".format(times[-16]))
+        self.assertEqual(status[-1], "\tNumber Infected is 0.\n")
+
+    def test_log_checkpoint(self):
+        model = build_model(target_size = 2500)
+        for _ in range(10):
+            model.single_time_step()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model.checkpoint(tmp_dir)
+            restored = build_model(target_size = 2500)
+            restored.restore(tmp_dir)
+        self.assertEqual(restored.get_exec_status(), model.get_exec_status())
+        self.assertTrue(np.array_equal(restored.get_exec_log(), model.get_exec_log()))
+        for a, b in zip(restored.get_last_transitions(), model.get_last_transitions()):
+            self.assertTrue(np.array_equal(a, b))
+        #  The records written after the resume match too
+        for _ in range(5):
+            model.single_time_step()
+            restored.single_time_step()
+        self.assertTrue(np.array_equal(restored.get_exec_log(), model.get_exec_log()))
+        self.assertTrue(np.array_equal(restored.get_people_state(), model.get_people_state()))